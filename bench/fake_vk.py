@@ -0,0 +1,210 @@
+import asyncio
+import json
+import random
+import re
+import time
+from collections import Counter, deque
+from aiohttp import web
+
+EXECUTE_CALL = re.compile(r'API\.([\w.]+)\((\{.*?\})\)')
+
+class FakeVKServer:
+    """Local stand-in for api.vk.com used by benchmarks.
+
+    Walls are synthetic unless `fixtures` maps owner_ids to payloads captured by bench.record.
+    `error_rate` fails that share of requests with VK error 10, and more than `rate_limit`
+    requests per second get error 6 like the real API.
+    """
+
+    def __init__(self, latency=0.2, posts_per_wall=10, error_rate=0.0, rate_limit=0,
+                 photos_per_post=0, text_size=0, fixtures=None, seed=None):
+        self.latency = latency
+        self.posts_per_wall = posts_per_wall
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.photos_per_post = photos_per_post
+        self.text_size = text_size
+        self.fixtures = fixtures or {}
+        self.random = random.Random(seed)
+        self.recent = deque()
+        self.events = {}
+        self.edited = {}
+        self.deleted = set()
+        self.calls = Counter()
+        self.runner = None
+        self.url = None
+
+    def _make_post(self, owner_id, post_id):
+        text = f"Post {post_id} from wall {owner_id}"
+        if self.text_size > len(text):
+            text += ' ' + ' '.join(['lorem_ipsum [id1|dolor] sit.'] * (self.text_size // 29))
+        return {
+            'id': post_id,
+            'owner_id': owner_id,
+            'from_id': owner_id,
+            'date': int(time.time()) - post_id * 60,
+            'text': text,
+            'attachments': [
+                {'type': 'photo', 'photo': {
+                    'id': post_id * 100 + i, 'owner_id': owner_id,
+                    'sizes': [
+                        {'type': 'm', 'width': 130, 'height': 98, 'url': f"https://fake.vk/{owner_id}_{post_id}_{i}_m.jpg"},
+                        {'type': 'z', 'width': 1280, 'height': 960, 'url': f"https://fake.vk/{owner_id}_{post_id}_{i}_z.jpg"}
+                    ]
+                }}
+                for i in range(self.photos_per_post)
+            ]
+        }
+
+    def wall_get(self, params):
+        owner_id = int(params.get('owner_id', 1))
+        count = int(params.get('count', 20))
+        offset = int(params.get('offset', 0))
+        if owner_id in self.fixtures:
+            fixture = self.fixtures[owner_id]
+            return {**fixture, 'count': len(fixture['items']), 'items': fixture['items'][offset:offset + count]}
+        items = [
+            self._post(owner_id, post_id)
+            for post_id in range(offset + 1, min(offset + count, self.posts_per_wall) + 1)
+            if (owner_id, post_id) not in self.deleted
+        ]
+        return {'count': self.posts_per_wall, 'items': items, 'profiles': [], 'groups': []}
+
+    def _post(self, owner_id, post_id):
+        post = self._make_post(owner_id, post_id)
+        if (owner_id, post_id) in self.edited:
+            post['text'] = self.edited[(owner_id, post_id)]
+        return post
+
+    def wall_get_by_id(self, params):
+        """Synthetic posts by `owner_post` ids, with edits and deletions set on `edited` / `deleted`"""
+        keys = [tuple(map(int, key.rsplit('_', 1))) for key in str(params.get('posts', '')).split(',') if key]
+        items = [self._post(*key) for key in keys if key not in self.deleted and key[1] <= self.posts_per_wall]
+        return {'items': items, 'profiles': [], 'groups': []}
+
+    def users_get(self, params):
+        return [
+            {'id': int(uid), 'first_name': 'User', 'last_name': str(uid)}
+            for uid in str(params.get('user_ids', '')).split(',') if uid
+        ]
+
+    def groups_get_by_id(self, params):
+        return [
+            {'id': int(gid), 'name': f"Group {gid}", 'screen_name': f"club{gid}"}
+            for gid in str(params.get('group_ids', '')).split(',') if gid
+        ]
+
+    def get_long_poll_server(self, params):
+        group_id = int(params['group_id'])
+        self.events.setdefault(group_id, asyncio.Queue())
+        return {'key': 'fake', 'server': f"{self.url.rsplit('/', 1)[0]}/longpoll/{group_id}", 'ts': '1'}
+
+    def push_post(self, group_id, post):
+        """Deliver a `wall_post_new` event to Bots Long Poll listeners of a community"""
+        self.events.setdefault(group_id, asyncio.Queue()).put_nowait(
+            {'type': 'wall_post_new', 'group_id': group_id, 'object': post, 'event_id': f"{group_id}_{post['id']}"}
+        )
+
+    async def handle_longpoll(self, request):
+        group_id = int(request.match_info['group_id'])
+        queue = self.events.setdefault(group_id, asyncio.Queue())
+        self.calls['longpoll'] += 1
+        try:
+            updates = [await asyncio.wait_for(queue.get(), timeout=float(request.query.get('wait', 25)))]
+        except asyncio.TimeoutError:
+            updates = []
+        while not queue.empty():
+            updates.append(queue.get_nowait())
+        return web.json_response({'ts': str(int(request.query.get('ts', 1)) + 1), 'updates': updates})
+
+    def execute(self, params):
+        """Understands the flat `return [API.method({...}), ...];` scripts the client sends"""
+        handlers = self._handlers()
+        return [
+            handlers[method](json.loads(args)) if method in handlers else False
+            for method, args in EXECUTE_CALL.findall(params.get('code', ''))
+        ]
+
+    def _handlers(self):
+        return {
+            'wall.get': self.wall_get,
+            'wall.getById': self.wall_get_by_id,
+            'users.get': self.users_get,
+            'groups.getById': self.groups_get_by_id,
+            'groups.getLongPollServer': self.get_long_poll_server,
+            'execute': self.execute
+        }
+
+    async def handle(self, request):
+        method = request.match_info['method']
+        params = {**request.query, **(await request.post())}
+        self.calls[method] += 1
+        await asyncio.sleep(self.latency)
+
+        if error := self._injected_error():
+            self.calls['errors'] += 1
+            return web.json_response({'error': {'error_code': error[0], 'error_msg': error[1]}})
+        handlers = self._handlers()
+        if method not in handlers:
+            return web.json_response({'error': {'error_code': 3, 'error_msg': 'Unknown method passed'}})
+        return web.json_response({'response': handlers[method](params)})
+
+    def _injected_error(self):
+        if self.rate_limit:
+            now = time.monotonic()
+            while self.recent and self.recent[0] < now - 1:
+                self.recent.popleft()
+            if len(self.recent) >= self.rate_limit:
+                return 6, 'Too many requests per second'
+            self.recent.append(now)
+        if self.error_rate and self.random.random() < self.error_rate:
+            return 10, 'Internal server error'
+        return None
+
+    @staticmethod
+    def load_fixtures(paths):
+        """Payloads written by bench.record, keyed by owner_id"""
+        fixtures = {}
+        for path in paths:
+            with open(path, encoding='utf-8') as f:
+                fixture = json.load(f)
+            fixtures[int(fixture['owner_id'])] = fixture
+        return fixtures
+
+    async def start(self, host='127.0.0.1', port=0):
+        app = web.Application()
+        app.router.add_route('*', '/method/{method}', self.handle)
+        app.router.add_get('/longpoll/{group_id}', self.handle_longpoll)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        bound_port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{bound_port}/method"
+        return self.url
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+    def start_in_thread(self, host='127.0.0.1', port=0):
+        """Serve from a background thread so blocking clients cannot stall the server"""
+        import threading
+        ready = threading.Event()
+        self.loop = asyncio.new_event_loop()
+
+        def serve():
+            asyncio.set_event_loop(self.loop)
+            self.loop.run_until_complete(self.start(host, port))
+            ready.set()
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(target=serve, daemon=True)
+        self.thread.start()
+        ready.wait()
+        return self.url
+
+    def stop_thread(self):
+        asyncio.run_coroutine_threadsafe(self.stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
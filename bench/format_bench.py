@@ -0,0 +1,57 @@
+"""Measure formatting and splitting of large VK posts into MarkdownV2 messages.
+
+Usage: python -m bench.format_bench [--posts 200] [--size 12000] [--routes 3]
+"""
+import argparse
+import random
+import statistics
+import time
+from modules import formatter
+
+WORDS = ['привет', 'world', 'snake_case', '*bold*', 'v1.2.3', '(note)', 'a+b=c', '#tag', '😀', 'x-y', 'end!']
+
+def make_text(rng, size):
+    """Text of roughly `size` characters with paragraphs, VK links and Markdown specials"""
+    parts, length = [], 0
+    while length < size:
+        roll = rng.random()
+        if roll < 0.03:
+            part = f"[id{rng.randint(1, 10**9)}|User {rng.randint(1, 999)}] "
+        elif roll < 0.05:
+            part = f"[https://example.com/p_{rng.randint(1, 999)}|a link] "
+        elif roll < 0.1:
+            part = '\n\n' if roll < 0.07 else '\n'
+        else:
+            part = rng.choice(WORDS) + ' '
+        parts.append(part)
+        length += len(part)
+    return ''.join(parts)
+
+def measure(corpus, routes):
+    formatter.split.cache_clear()
+    timings, chunks = [], 0
+    for text in corpus:
+        started = time.perf_counter()
+        # The same post is formatted once per route; only the first call does any work
+        for _ in range(routes):
+            result = formatter.split(text, formatter.CAPTION_LIMIT)
+        timings.append(time.perf_counter() - started)
+        chunks += len(result)
+    return timings, chunks
+
+def run(args):
+    rng = random.Random(args.seed)
+    corpus = [make_text(rng, args.size) for _ in range(args.posts)]
+    timings, chunks = measure(corpus, args.routes)
+    total = sum(timings)
+    print(f"{args.posts} posts of ~{args.size} chars x {args.routes} routes -> {chunks} messages")
+    print(f"{args.posts / total:.0f} posts/s, median {statistics.median(timings) * 1000:.2f} ms, "
+          f"max {max(timings) * 1000:.2f} ms per post")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--posts', type=int, default=200)
+    parser.add_argument('--size', type=int, default=12000)
+    parser.add_argument('--routes', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    run(parser.parse_args())
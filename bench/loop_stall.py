@@ -0,0 +1,72 @@
+"""Measure how long VK polling stalls the event loop.
+
+Usage: python -m bench.loop_stall [--latency 0.2] [--polls 10]
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+import urllib.parse
+import urllib.request
+from bench.fake_vk import FakeVKServer
+from modules.vk_api_client import VKClient
+
+class StaticConfig:
+    def __init__(self, **values):
+        self.values = values
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def data_path(self, filename):
+        return os.path.join(tempfile.gettempdir(), f"vk2tg-bench-{filename}")
+
+def blocking_wall_get(api_url, owner_id):
+    """Synchronous request, equivalent to what vk_api did inside the loop"""
+    data = urllib.parse.urlencode({'owner_id': owner_id, 'count': 10}).encode()
+    with urllib.request.urlopen(f"{api_url}/wall.get", data=data) as response:
+        return json.loads(response.read())
+
+async def watch_loop(stop, interval=0.005):
+    """Return the worst delay between scheduled and actual wake-ups"""
+    worst = 0.0
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - started - interval)
+    return worst
+
+async def measure(poll, polls):
+    stop = asyncio.Event()
+    watcher = asyncio.create_task(watch_loop(stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(poll() for _ in range(polls)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    return elapsed, await watcher
+
+async def run(latency, polls):
+    server = FakeVKServer(latency=latency)
+    api_url = server.start_in_thread()
+    config = StaticConfig(vk_access_token='bench', vk_user_id=1, vk_api_url=api_url)
+    client = VKClient(config)
+
+    async def blocking_poll():
+        blocking_wall_get(api_url, 1)
+
+    try:
+        for name, poll in (('blocking', blocking_poll), ('async', client.get_new_posts)):
+            elapsed, stall = await measure(poll, polls)
+            print(f"{name:>8}: {polls} polls in {elapsed:.3f}s, max loop stall {stall * 1000:.1f} ms")
+    finally:
+        await client.close()
+        server.stop_thread()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--polls', type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(run(args.latency, args.polls))
@@ -0,0 +1,83 @@
+"""Measure end-to-end latency of publishing attachment-heavy posts.
+
+Usage: python -m bench.post_latency [--docs 4] [--audio 2] [--reposts 2] [--posts 3]
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from bench.fake_vk import FakeVKServer
+from bench.loop_stall import StaticConfig
+from bench.stub_bot_api import StubBotAPI
+from modules.telegram_bot import TelegramPoster
+from modules.vk_api_client import VKClient
+
+def make_post(stub, post_id, docs, audio, reposts):
+    def attachments(prefix):
+        # Every attachment gets its own VK id so the file_id cache cannot short-circuit uploads
+        return [
+            {'type': 'doc', 'doc': {
+                'id': f"{prefix}-{i}", 'owner_id': 1, 'title': f"{prefix}-doc-{i}", 'ext': 'pdf',
+                'size': 512 * 1024, 'url': stub.file_url(512 * 1024, f"{prefix}-{i}.pdf")
+            }}
+            for i in range(docs)
+        ] + [
+            {'type': 'audio', 'audio': {
+                'artist': 'Bench', 'title': f"{prefix}-track-{i}",
+                'url': stub.file_url(256 * 1024, f"{prefix}-{i}.mp3")
+            }}
+            for i in range(audio)
+        ]
+
+    return {
+        'id': post_id,
+        'owner_id': 1,
+        'date': int(time.time()),
+        'text': f"Benchmark post {post_id}",
+        'attachments': attachments(f"p{post_id}"),
+        'copy_history': [
+            {'id': r, 'owner_id': -r - 1, 'text': f"Repost {r}", 'attachments': attachments(f"p{post_id}r{r}")}
+            for r in range(reposts)
+        ]
+    }
+
+async def run(args):
+    vk_server = FakeVKServer(latency=0.05)
+    stub = StubBotAPI(latency=args.tg_latency, download_latency=args.download_latency)
+    vk_url = await vk_server.start()
+    tg_url = await stub.start()
+
+    for concurrency in (1, args.concurrency):
+        config = StaticConfig(
+            vk_access_token='bench', vk_user_id=1, vk_api_url=vk_url,
+            tg_bot_token='123456:BENCH', tg_channel_id=-100, tg_api_url=tg_url,
+            attachment_concurrency=concurrency,
+            # Measure the pipeline, not the per-chat Bot API quota
+            tg_chat_rate=1000, tg_chat_burst=1000
+        )
+        vk = VKClient(config)
+        poster = TelegramPoster(config, vk)
+        latencies = []
+        for post_id in range(args.posts):
+            post = make_post(stub, post_id, args.docs, args.audio, args.reposts)
+            started = time.perf_counter()
+            await poster.process_post(post)
+            latencies.append(time.perf_counter() - started)
+        print(f"concurrency={concurrency}: median {statistics.median(latencies):.3f}s, "
+              f"max {max(latencies):.3f}s per post")
+        await poster.close()
+        await vk.close()
+
+    await stub.stop()
+    await vk_server.stop()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--docs', type=int, default=4)
+    parser.add_argument('--audio', type=int, default=2)
+    parser.add_argument('--reposts', type=int, default=2)
+    parser.add_argument('--posts', type=int, default=3)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--tg-latency', type=float, default=0.05)
+    parser.add_argument('--download-latency', type=float, default=0.3)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,50 @@
+"""Capture real wall.get payloads into fixture files for bench.replay.
+
+Usage: VK_ACCESS_TOKEN=... python -m bench.record --owner -1 [--owner 2] [--posts 100] [--out fixtures]
+"""
+import argparse
+import asyncio
+import json
+import os
+from bench.loop_stall import StaticConfig
+from modules.vk_api_client import CATCHUP_PAGE_SIZE, VKClient
+
+async def record_wall(vk, owner_id, posts):
+    """Newest `posts` posts of a wall with the profiles and groups VK sent along"""
+    fixture = {'owner_id': owner_id, 'items': [], 'profiles': {}, 'groups': {}}
+    while len(fixture['items']) < posts:
+        count = min(CATCHUP_PAGE_SIZE, posts - len(fixture['items']))
+        response = await vk.get_wall(owner_id, count, len(fixture['items']))
+        fixture['items'] += response['items']
+        fixture['profiles'].update({profile['id']: profile for profile in response.get('profiles', [])})
+        fixture['groups'].update({group['id']: group for group in response.get('groups', [])})
+        if len(response['items']) < count:
+            break
+    fixture['profiles'] = list(fixture['profiles'].values())
+    fixture['groups'] = list(fixture['groups'].values())
+    return fixture
+
+async def run(args):
+    token = args.token or os.environ.get('VK_ACCESS_TOKEN')
+    if not token:
+        raise SystemExit("Pass --token or set VK_ACCESS_TOKEN")
+
+    os.makedirs(args.out, exist_ok=True)
+    vk = VKClient(StaticConfig(vk_access_token=token, vk_sources=args.owner))
+    try:
+        for owner_id in args.owner:
+            fixture = await record_wall(vk, owner_id, args.posts)
+            path = os.path.join(args.out, f"wall_{owner_id}.json")
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(fixture, f, ensure_ascii=False)
+            print(f"Wall {owner_id}: {len(fixture['items'])} posts -> {path}")
+    finally:
+        await vk.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--owner', type=int, action='append', required=True, help="wall owner_id, repeatable")
+    parser.add_argument('--posts', type=int, default=100)
+    parser.add_argument('--out', default='fixtures')
+    parser.add_argument('--token', help="VK access token (defaults to $VK_ACCESS_TOKEN)")
+    asyncio.run(run(parser.parse_args()))
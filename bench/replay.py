@@ -0,0 +1,125 @@
+"""Push synthetic or recorded walls through the full VK2TG pipeline against local stub servers.
+
+Usage: python -m bench.replay [--walls 5] [--posts 50] [--photos 2] [--fixtures fixtures/wall_-1.json ...]
+       [--vk-error-rate 0.05] [--vk-rate-limit 3] [--tg-error-rate 0.02] [--tg-rate-limit 30]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+import tracemalloc
+from bench.fake_vk import FakeVKServer
+from bench.stub_bot_api import StubBotAPI
+from main import VK2TG
+from modules.post_index import post_key
+
+class ReplayBot(VK2TG):
+    """VK2TG that records when each post was picked up from VK and when it was published"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.picked_up = {}
+        self.latencies = []
+        self.progress = asyncio.Event()
+
+    async def _process_posts(self, source, posts):
+        now = time.perf_counter()
+        for post in posts:
+            self.picked_up.setdefault(post_key(post), now)
+        return await super()._process_posts(source, posts)
+
+    async def _publish(self, entries):
+        failed = await super()._publish(entries)
+        if not failed:
+            self.latencies.append(time.perf_counter() - self.picked_up[post_key(entries[0]['post'])])
+            self.progress.set()
+        return failed
+
+def percentile(values, share):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))] if ordered else 0.0
+
+async def run(args):
+    fixtures = FakeVKServer.load_fixtures(args.fixtures) if args.fixtures else {}
+    vk_server = FakeVKServer(
+        latency=args.vk_latency, posts_per_wall=args.posts, error_rate=args.vk_error_rate,
+        rate_limit=args.vk_rate_limit, photos_per_post=args.photos, text_size=args.text_size,
+        fixtures=fixtures, seed=args.seed
+    )
+    stub = StubBotAPI(
+        latency=args.tg_latency, download_latency=0, rate_limit=args.tg_rate_limit,
+        error_rate=args.tg_error_rate, seed=args.seed
+    )
+    vk_url = await vk_server.start()
+    tg_url = await stub.start()
+
+    sources = list(fixtures) or [-(i + 1) for i in range(args.walls)]
+    expected = sum(len(fixture['items']) for fixture in fixtures.values()) or args.walls * args.posts
+
+    with tempfile.TemporaryDirectory(prefix='vk2tg-replay-') as data_dir:
+        config_path = os.path.join(data_dir, 'config.json')
+        with open(config_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'vk_access_token': 'replay', 'vk_sources': sources, 'vk_api_url': vk_url,
+                'tg_bot_token': '123456:REPLAY', 'tg_channel_id': -100, 'tg_api_url': tg_url,
+                # Publish everything as fast as the stubs allow, starting from the oldest post
+                'last_post_date': 1, 'publish_interval': 0,
+                'poll_interval': 1, 'poll_min_interval': 1, 'poll_max_interval': 5,
+                'catchup_max_pages': expected // 100 + 2,
+                'tg_global_rate': args.tg_rate, 'tg_chat_rate': args.tg_rate, 'tg_chat_burst': args.tg_rate
+            }, f)
+
+        tracemalloc.start()
+        bot = ReplayBot(config_path)
+        started = time.perf_counter()
+        task = asyncio.create_task(bot.monitor())
+        try:
+            while len(bot.latencies) < expected and time.perf_counter() - started < args.timeout:
+                bot.progress.clear()
+                try:
+                    await asyncio.wait_for(bot.progress.wait(), timeout=1)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            elapsed = time.perf_counter() - started
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+    await stub.stop()
+    await vk_server.stop()
+
+    published = len(bot.latencies)
+    vk_calls = sum(count for method, count in vk_server.calls.items() if method != 'errors')
+    tg_calls = sum(count for method, count in stub.calls.items() if method not in ('download', 'flood_wait', 'server_error'))
+    print(f"Published {published}/{expected} posts from {len(sources)} walls in {elapsed:.2f}s "
+          f"({published / elapsed:.1f} posts/s)")
+    print(f"Publish latency: p50 {percentile(bot.latencies, 0.5):.3f}s, p99 {percentile(bot.latencies, 0.99):.3f}s")
+    print(f"Memory peak: {peak / 1024 / 1024:.1f} MB")
+    print(f"API calls per post: VK {vk_calls / max(1, published):.2f} {dict(vk_server.calls)}, "
+          f"Telegram {tg_calls / max(1, published):.2f} {dict(stub.calls)}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--walls', type=int, default=5)
+    parser.add_argument('--posts', type=int, default=50, help="posts per synthetic wall")
+    parser.add_argument('--photos', type=int, default=2, help="photos per synthetic post")
+    parser.add_argument('--text-size', type=int, default=500, help="characters per synthetic post")
+    parser.add_argument('--fixtures', nargs='*', help="wall files written by bench.record instead of synthetic walls")
+    parser.add_argument('--vk-latency', type=float, default=0.05)
+    parser.add_argument('--vk-error-rate', type=float, default=0.0)
+    parser.add_argument('--vk-rate-limit', type=int, default=0, help="VK requests per second before error 6")
+    parser.add_argument('--tg-latency', type=float, default=0.02)
+    parser.add_argument('--tg-error-rate', type=float, default=0.0)
+    parser.add_argument('--tg-rate-limit', type=int, default=0, help="Bot API calls per second before a 429")
+    parser.add_argument('--tg-rate', type=float, default=1000, help="client-side Bot API rate limit")
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--log-level', default='ERROR')
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level)
+    asyncio.run(run(args))
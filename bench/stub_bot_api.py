@@ -0,0 +1,129 @@
+import asyncio
+import json
+import random
+import time
+from collections import Counter, deque
+from aiohttp import web
+
+class StubBotAPI:
+    """Local stand-in for the Telegram Bot API plus a file host that plays the VK CDN.
+
+    Flood waits are injected every `flood_every` calls or when more than `rate_limit` calls
+    arrive within a second; `error_rate` fails that share of calls with a 500.
+    """
+
+    def __init__(self, latency=0.05, download_latency=0.2, chunk_delay=0.0, flood_every=0, retry_after=1,
+                 rate_limit=0, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.flood_every = flood_every
+        self.retry_after = retry_after
+        self.rate_limit = rate_limit
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.recent = deque()
+        self.download_latency = download_latency
+        self.chunk_delay = chunk_delay
+        self.calls = Counter()
+        self.message_id = 0
+        self.runner = None
+        self.url = None
+
+    def _message(self, chat_id, **content):
+        self.message_id += 1
+        return {
+            'message_id': self.message_id,
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id or 0), 'type': 'channel'},
+            **content
+        }
+
+    def _file(self, kind):
+        file_id = f"{kind}-{self.message_id + 1}"
+        return {'file_id': file_id, 'file_unique_id': file_id}
+
+    def _result(self, method, form, chat_id):
+        """Messages shaped like the Bot API's, including file_ids of uploaded media"""
+        if method == 'sendMediaGroup':
+            media = json.loads(form.get('media', '[]'))
+            return [
+                self._message(chat_id, photo=[{**self._file('photo'), 'width': 1280, 'height': 960}])
+                for _ in media
+            ] or [self._message(chat_id)]
+        if method == 'sendPhoto':
+            return self._message(chat_id, photo=[{**self._file('photo'), 'width': 1280, 'height': 960}])
+        if method == 'sendDocument':
+            return self._message(chat_id, document=self._file('document'))
+        if method == 'sendAudio':
+            return self._message(chat_id, audio={**self._file('audio'), 'duration': 180})
+        if method == 'deleteMessages':
+            return True
+        if method in ('editMessageText', 'editMessageCaption'):
+            return {'message_id': int(form.get('message_id', 0)), 'date': int(time.time()),
+                    'chat': {'id': int(chat_id or 0), 'type': 'channel'}}
+        return self._message(chat_id)
+
+    async def handle_method(self, request):
+        method = request.match_info['method']
+        form = await request.post()
+        self.calls[method] += 1
+        await asyncio.sleep(self.latency)
+
+        if self.flood_every and sum(self.calls.values()) % self.flood_every == 0 or self._over_rate_limit():
+            self.calls['flood_wait'] += 1
+            return web.json_response({
+                'ok': False,
+                'error_code': 429,
+                'description': f"Too Many Requests: retry after {self.retry_after}",
+                'parameters': {'retry_after': self.retry_after}
+            }, status=429)
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.calls['server_error'] += 1
+            return web.json_response({'ok': False, 'error_code': 500, 'description': 'Internal Server Error'}, status=500)
+
+        chat_id = form.get('chat_id', request.query.get('chat_id'))
+        return web.json_response({'ok': True, 'result': self._result(method, form, chat_id)})
+
+    def _over_rate_limit(self):
+        if not self.rate_limit:
+            return False
+        now = time.monotonic()
+        while self.recent and self.recent[0] < now - 1:
+            self.recent.popleft()
+        if len(self.recent) >= self.rate_limit:
+            return True
+        self.recent.append(now)
+        return False
+
+    async def handle_file(self, request):
+        """Serve `size` bytes after a delay, like a slow CDN"""
+        size = int(request.match_info['size'])
+        self.calls['download'] += 1
+        await asyncio.sleep(self.download_latency)
+        response = web.StreamResponse()
+        response.content_length = size
+        await response.prepare(request)
+        chunk = b'\0' * 65536
+        for start in range(0, size, len(chunk)):
+            await response.write(chunk[:size - start])
+            if self.chunk_delay:
+                await asyncio.sleep(self.chunk_delay)
+        return response
+
+    def file_url(self, size, name='file'):
+        return f"{self.url}/files/{size}/{name}"
+
+    async def start(self, host='127.0.0.1', port=0):
+        app = web.Application(client_max_size=1024 ** 3)
+        app.router.add_post('/bot{token}/{method}', self.handle_method)
+        app.router.add_get('/files/{size}/{name}', self.handle_file)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        bound_port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{bound_port}"
+        return self.url
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
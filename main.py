@@ -1,92 +1,372 @@
+import argparse
 import asyncio
+import functools
 import logging
 import sys
 import os
+import time
 from datetime import datetime
+from modules import metrics
+from modules.backfill import Backfill
 from modules.config_handler import ConfigHandler
+from modules.http import HttpPool
 from modules.vk_api_client import VKClient
 from modules.telegram_bot import TelegramPoster
+from modules.scheduler import PublishScheduler
+from modules.state_store import StateStore
+from modules.post_index import PostIndex, post_key
+from modules.poll_scheduler import AdaptivePoller
+from modules.routing import RoutingTable
+from modules.sync import PostSync
+from modules.vk_events import VKEvents
+from modules.supervisor import run_shards, tenant_data_dir
+
+def setup_logging(level=logging.INFO):
+    """Initialize logging configuration"""
+    log_filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vk2tg.log')
+    logging.basicConfig(
+        filename=log_filename,
+        level=level,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        force=True
+    )
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    logging.getLogger().addHandler(console)
+
+POSTS_QUEUED = metrics.counter('vk2tg_posts_queued_total', "New VK posts queued per destination")
+POLL_ERRORS = metrics.counter('vk2tg_poll_errors_total', "Failed polls of a VK wall")
+PUBLISH_LAG = metrics.histogram(
+    'vk2tg_publish_lag_seconds', "Time from a VK post's date to its publication in Telegram",
+    buckets=metrics.LAG_BUCKETS
+)
 
 class VK2TG:
-    def __init__(self):
-        self._setup_logging()
-        self.config = ConfigHandler(sys.argv[1] if len(sys.argv) > 1 else None)
+    def __init__(self, config_path=None, data_dir=None, supervisor=None):
+        self.config = ConfigHandler(config_path, data_dir)
+        self.supervisor = supervisor
         
         if not self._validate_config():
-            print("Error: Invalid configuration. Please create config first:")
-            print("https://daniilsavenya.github.io/Repost_bot/auth.html")
-            sys.exit(1)
-
-        self.vk = VKClient(self.config)
-        self.tg = TelegramPoster(self.config, self.vk)
-
-    def _setup_logging(self):
-        """Initialize logging configuration"""
-        log_filename = os.path.join(os.path.dirname(__file__), 'vk2tg.log')
-        logging.basicConfig(
-            filename=log_filename,
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            force=True
+            raise ValueError(f"Invalid configuration: {self.config.config_path}")
+
+        # VK, downloads and the Bot API share one connection pool; under a supervisor, all tenants do
+        self.http = supervisor.http if supervisor else HttpPool(
+            limit=self.config.get('http_pool_size', 100),
+            limit_per_host=self.config.get('http_pool_per_host', 0),
+            dns_ttl=self.config.get('dns_cache_ttl', 300),
+            keepalive=self.config.get('http_keepalive', 30)
         )
-        console = logging.StreamHandler()
-        console.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-        logging.getLogger().addHandler(console)
+
+        self.vk = VKClient(self.config, http=self.http)
+        self.state = StateStore(self.config.get('state_path') or self.config.data_path('state.db'))
+        self.tg = None
+        try:
+            self.tg = TelegramPoster(
+                self.config, self.vk, self.state, session=self.http.bot_session(self.config.get('tg_api_url'))
+            )
+            self.routing = RoutingTable(self.config.get('routes'), self.config.get('tg_channel_id'))
+            self.index = PostIndex(self.state, max_entries=self.config.get('dedup_max_entries', 10000))
+            self.poller = AdaptivePoller(
+                self.vk.get_sources(),
+                base=self.config.get('poll_interval', 60),
+                min_interval=self.config.get('poll_min_interval', 15),
+                max_interval=self.config.get('poll_max_interval', 600)
+            )
+            self.scheduler = PublishScheduler(
+                self.state,
+                self._publish,
+                default_interval=self.config.get('publish_interval', 7200),
+                channel_intervals={**self.routing.intervals(), **(self.config.get('channel_publish_intervals') or {})},
+                max_attempts=self.config.get('publish_max_attempts', 5),
+                retry_delay=self.config.get('publish_retry_delay', 60)
+            )
+            self.events = VKEvents(self.config, self.vk, self._ingest_event, self._set_event_state)
+            self.sync = None
+            if self.config.get('sync_edits'):
+                self.sync = PostSync(
+                    self.vk, self.tg, self.index, self.routing,
+                    interval=self.config.get('sync_interval', 600),
+                    max_posts=self.config.get('sync_max_posts', 200)
+                )
+        except Exception:
+            # Nothing is running yet: release what was opened, or a restarting supervisor leaks it
+            if self.tg and self.tg.images:
+                self.tg.images.close()
+            self.state.close()
+            raise
+        self.tasks = []
+        self.metrics_runner = None
 
     def _validate_config(self):
         """Validate required configuration parameters"""
         required_keys = {
             'vk_access_token': "VK access token",
-            'vk_user_id': "VK user ID",
-            'tg_channel_id': "Telegram channel ID",
             'tg_bot_token': "Telegram bot token"
         }
         
         missing = [name for key, name in required_keys.items() if not self.config.get(key)]
+        if not self.config.get('vk_user_id') and not self.config.get('vk_sources'):
+            missing.append("VK user ID")
+        if not self.config.get('tg_channel_id') and not self.config.get('routes'):
+            missing.append("Telegram channel ID")
         if missing:
             logging.error(f"Missing configuration parameters: {', '.join(missing)}")
             return False
             
-        if self.config.get('tg_channel_id', 0) >= 0:
+        if self.config.get('tg_channel_id') and self.config.get('tg_channel_id') >= 0:
             logging.error("Telegram Channel ID must be negative (channel chat)")
             return False
             
         return True
 
-    async def _process_posts(self, posts):
-        """Process and publish new posts"""
-        last_post_date = self.config.get('last_post_date') or 0
-        new_posts = [p for p in posts if p['date'] > last_post_date]
-        new_posts.sort(key=lambda x: x['date'])
+    def _get_cursor(self, source):
+        """Date of the last published post for a VK wall"""
+        cursor = self.state.get_cursor(source)
+        if cursor is None:
+            # First run for this wall: take over a cursor left in config.json, else start from now
+            cursors = self.config.get('last_post_dates') or {}
+            legacy = cursors.get(str(source), self.config.get('last_post_date'))
+            # Legacy cursors were exclusive; nudge them so posts at that exact second stay skipped
+            cursor = legacy + 0.5 if legacy else time.time()
+            with self.state.transaction():
+                self.state.set_cursor(source, cursor)
+                self.state.set(f'live_since:{source}', cursor)
+        return cursor
+
+    def _live_since(self, source):
+        """Date the bot started mirroring a wall from; older posts are left to backfill"""
+        cursor = self._get_cursor(source)
+        # Walls first polled by an older version have no record; their cursor is the best bound
+        return self.state.get(f'live_since:{source}', cursor)
+
+    def _set_cursor(self, source, date):
+        self.state.set_cursor(source, date)
+
+    def _is_seen(self, post):
+        """Posts already queued or older than the wall cursor end a VK fetch"""
+        return post_key(post) in self.index or post['date'] < self._get_cursor(post['owner_id'])
+
+    async def _process_posts(self, source, posts):
+        """Queue new posts for publishing"""
+        last_post_date = self._get_cursor(source)
+        new_posts = []
+        for post in posts:
+            # Edits of posts already in the index are PostSync's to apply
+            if post_key(post) not in self.index and post['date'] >= last_post_date:
+                new_posts.append(post)
+        new_posts.sort(key=lambda x: (x['date'], x['id']))
 
         if not new_posts:
-            logging.info("No new posts to publish")
-            return
+            logging.info(f"No new posts to publish from wall {source}")
+            return 0
 
-        for i, post in enumerate(new_posts):
-            try:
-                await self.tg.process_post(post)
-                self.config.set('last_post_date', post['date'])
-                logging.info(f"Published post from {self._format_date(post['date'])}")
-            except Exception as e:
-                logging.exception(f"Post processing error: {str(e)}")
-            if i < len(new_posts) - 1:
-                await asyncio.sleep(7200)
+        with self.state.transaction():
+            for post in new_posts:
+                for route in self.routing.destinations(source):
+                    if not route.accepts(post):
+                        logging.info(f"Post {post['owner_id']}_{post['id']} filtered out for {route.chat_id}")
+                        continue
+                    publish_at = self.scheduler.enqueue(source, post, route.chat_id)
+                    POSTS_QUEUED.inc()
+                    logging.info(
+                        f"Queued post from {self._format_date(post['date'])} "
+                        f"for {route.chat_id} at {self._format_date(publish_at)}"
+                    )
+                self.index.add(post)
+                self._set_cursor(source, post['date'])
+        return len(new_posts)
+
+    async def _publish(self, entries):
+        """Publish a post whose scheduled time has come to all of its due destinations; returns the failed entries"""
+        post = entries[0]['post']
+        routes = [self.routing.route(entry['source'], entry['chat_id']) for entry in entries]
+        results = await self.tg.process_post(post, routes, best_effort=self.scheduler.is_last_attempt(entries))
+        failed = [entry for entry in entries if results[entry['chat_id']].error]
+        with self.state.transaction():
+            for chat_id, ctx in results.items():
+                if not ctx.error:
+                    self.index.set_messages(post_key(post), chat_id, ctx.message_ids, ctx.layout)
+        if len(failed) < len(entries):
+            PUBLISH_LAG.observe(max(0, time.time() - post['date']))
+            logging.info(f"Published post from {self._format_date(post['date'])}")
+        return failed
 
     def _format_date(self, timestamp):
         """Convert timestamp to readable format"""
         return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
 
-    async def monitor(self):
-        """Main monitoring loop"""
-        while True:
+    async def _poll(self, sources):
+        """Fetch the given walls once and feed the results back into the poll scheduler; returns failed walls"""
+        try:
+            walls, errors = await self.vk.get_new_posts_multi(sources, is_seen=self._is_seen)
+        except Exception as e:
+            logging.exception(f"Monitoring error: {str(e)}")
+            for source in sources:
+                POLL_ERRORS.inc()
+                self.poller.record_error(source, e)
+            return set(sources)
+
+        failed = set()
+        for source, posts in walls.items():
+            if source in errors:
+                POLL_ERRORS.inc()
+                self.poller.record_error(source, errors[source])
+                failed.add(source)
+                continue
             try:
-                posts = self.vk.get_new_posts()
-                await self._process_posts(posts)
+                self.poller.record_success(source, await self._process_posts(source, posts))
             except Exception as e:
                 logging.exception(f"Monitoring error: {str(e)}")
-            await asyncio.sleep(60)
+                POLL_ERRORS.inc()
+                self.poller.record_error(source, e)
+                failed.add(source)
+        logging.debug(f"Poll intervals: {self.poller.intervals()}")
+        return failed
+
+    async def _ingest_event(self, source, post):
+        """Queue a post pushed by VK Long Poll or Callback API like a polled one"""
+        await self._process_posts(source, self.vk.normalize_posts([post]))
+
+    async def _set_event_state(self, source, live):
+        """Suspend polling of a wall while its events flow, after catching up on what they missed"""
+        if not live:
+            logging.info(f"Events of wall {source} are down, polling it again")
+            self.poller.resume(source)
+            await self._poll([source])
+            return
+        if source in await self._poll([source]):
+            return
+        logging.info(f"Wall {source} now follows VK events, polling suspended")
+        self.poller.suspend(source)
+
+    async def start(self):
+        """Open the connection pool and start everything that runs next to polling"""
+        self.http.session()
+        self.tasks = [asyncio.create_task(self.scheduler.run())]
+        if self.sync:
+            self.tasks.append(asyncio.create_task(self.sync.run()))
+        await self.events.start()
+        if self.config.get('metrics_port') and not self.supervisor:
+            self.metrics_runner = await metrics.start_server(
+                self.config.get('metrics_port'), self.config.get('metrics_host', '127.0.0.1')
+            )
+
+    async def close(self):
+        """Stop background tasks, then release connections, worker processes and the state store"""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        await self.events.close()
+        if self.metrics_runner:
+            await self.metrics_runner.cleanup()
+        await self.vk.close()
+        await self.tg.close()
+        if not self.supervisor:
+            await self.http.close()
+        self.state.close()
+
+    async def backfill(self, source, since=0, chat_id=None, dry_run=False, export_path=None):
+        """Publish the history of a wall up to where live polling starts, oldest post first"""
+        backfill = Backfill(
+            self.vk, self.tg, self.state, self.index, self.routing,
+            pages_per_call=self.config.get('backfill_pages_per_call', 10),
+            max_attempts=self.config.get('publish_max_attempts', 5),
+            retry_delay=self.config.get('publish_retry_delay', 60)
+        )
+        try:
+            # Posts from where live mirroring began are the live bot's, so both can run side by side
+            return await backfill.run(
+                source, self._live_since(source), since=since, chat_id=chat_id,
+                dry_run=dry_run, export_path=export_path
+            )
+        finally:
+            await self.close()
+
+    async def replay_dead_letters(self, ids=None):
+        """Send Bot API calls given up on again, all or those in `ids`; returns (sent, failed)"""
+        try:
+            return await self.tg.replay_dead_letters(ids)
+        finally:
+            await self.close()
+
+    async def monitor(self):
+        """Main monitoring loop"""
+        await self.start()
+        try:
+            while True:
+                if due := self.poller.due():
+                    await self._poll(due)
+                await asyncio.sleep(max(1, self.poller.next_wakeup() - time.time()))
+        finally:
+            await self.close()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="VK to Telegram repost bot")
+    parser.add_argument('config', nargs='?', help="path to config.json (single bot mode)")
+    parser.add_argument('--config-dir', help="run every *.json config in this directory in one process")
+    parser.add_argument('--data-dir', help="keep state files here instead of next to the config")
+    parser.add_argument('--workers', type=int, default=1, help="shard --config-dir tenants across N processes")
+    parser.add_argument('--scan-interval', type=float, default=10, help="seconds between --config-dir rescans")
+    parser.add_argument('--metrics-port', type=int, help="serve /metrics for all --config-dir tenants on this port")
+    parser.add_argument('--backfill', type=int, metavar='OWNER_ID', help="publish the history of a wall and exit")
+    parser.add_argument('--chat', type=int, help="backfill into this chat only instead of all routes of the wall")
+    parser.add_argument('--since', help="backfill posts from this date on (YYYY-MM-DD)")
+    parser.add_argument('--dry-run', action='store_true', help="backfill: fetch the wall without publishing")
+    parser.add_argument('--export', metavar='PATH', help="backfill: write the fetched posts to a JSONL archive")
+    parser.add_argument('--dead-letters', action='store_true', help="list Bot API calls given up on and exit")
+    parser.add_argument('--replay-dead-letters', type=int, nargs='*', metavar='ID',
+                        help="send dead letters again (all, or the given ids) and exit")
+    parser.add_argument('--debug', action='store_true', help="verbose logging")
+    args = parser.parse_args()
+    if args.config_dir and (args.backfill is not None or args.data_dir or args.dead_letters
+                            or args.replay_dead_letters is not None):
+        parser.error("--backfill, --dead-letters and --data-dir take a single config; "
+                     "pass one file of the --config-dir instead")
+    return args
 
 if __name__ == '__main__':
-    bot = VK2TG()
+    args = parse_args()
+    log_level = logging.DEBUG if args.debug else logging.INFO
+
+    if args.config_dir:
+        run_shards(
+            args.config_dir, VK2TG, args.workers,
+            setup=functools.partial(setup_logging, log_level),
+            scan_interval=args.scan_interval,
+            metrics_port=args.metrics_port
+        )
+        sys.exit(0)
+
+    setup_logging(log_level)
+    data_dir = args.data_dir
+    if data_dir is None and args.config and os.path.isdir(tenant_data_dir(args.config)):
+        # A config of a --config-dir: share the state the supervisor keeps for it
+        data_dir = tenant_data_dir(args.config)
+        logging.info(f"Using tenant data directory {data_dir}")
+    try:
+        bot = VK2TG(args.config, data_dir=data_dir)
+    except ValueError:
+        print("Error: Invalid configuration. Please create config first:")
+        print("https://daniilsavenya.github.io/Repost_bot/auth.html")
+        sys.exit(1)
+
+    if args.dead_letters:
+        for letter_id, chat_id, method, error, failed_at, replayable in bot.tg.dispatcher.list_dead_letters():
+            print(f"{letter_id}\t{datetime.fromtimestamp(failed_at):%Y-%m-%d %H:%M}\t{chat_id}\t{method}\t"
+                  f"{'' if replayable else '(not replayable) '}{error}")
+        asyncio.run(bot.close())
+        sys.exit(0)
+    if args.replay_dead_letters is not None:
+        sent, failed = asyncio.run(bot.replay_dead_letters(args.replay_dead_letters))
+        print(f"Dead letters: {sent} replayed, {failed} failed again")
+        sys.exit(0)
+
+    if args.backfill is not None:
+        since = datetime.strptime(args.since, '%Y-%m-%d').timestamp() if args.since else 0
+        stats = asyncio.run(bot.backfill(
+            args.backfill, since=since, chat_id=args.chat, dry_run=args.dry_run, export_path=args.export
+        ))
+        print(f"Backfill of wall {args.backfill}: {stats['collected']} posts fetched, "
+              f"{stats['published']} published, {stats['exported']} exported")
+        sys.exit(0)
     asyncio.run(bot.monitor())
\ No newline at end of file
@@ -0,0 +1,44 @@
+import asyncio
+import logging
+
+class AttachmentPipeline:
+    """Prepares a post's downloadable attachments concurrently and hands them out in post order.
+
+    One pipeline is shared by all destinations of a post, so each file is downloaded once.
+    """
+
+    def __init__(self, prepare, concurrency=4):
+        self.prepare = prepare
+        self.semaphore = asyncio.Semaphore(max(1, concurrency))
+        self.tasks = {}
+        self.locks = {}
+
+    def lock(self, key):
+        """Per-media lock so concurrent destinations upload a file once and reuse its file_id"""
+        return self.locks.setdefault(key, asyncio.Lock())
+
+    def prefetch(self, attachments):
+        for att in attachments:
+            if id(att) not in self.tasks:
+                self.tasks[id(att)] = asyncio.create_task(self._run(att))
+
+    async def _run(self, att):
+        async with self.semaphore:
+            return await self.prepare(att)
+
+    async def get(self, att):
+        """Prepared attachment, or None if it was not prefetched"""
+        task = self.tasks.get(id(att))
+        return await task if task else None
+
+    async def close(self):
+        """Cancel unfinished downloads and remove any spooled files nobody consumed"""
+        for task in self.tasks.values():
+            task.cancel()
+        for result in await asyncio.gather(*self.tasks.values(), return_exceptions=True):
+            if hasattr(result, 'cleanup'):
+                result.cleanup()
+            elif isinstance(result, Exception) and not isinstance(result, asyncio.CancelledError):
+                logging.debug(f"Prefetch failed: {result}")
+        self.tasks.clear()
+        self.locks.clear()
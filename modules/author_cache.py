@@ -0,0 +1,78 @@
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+
+class AuthorCache:
+    """LRU cache of VK author names with TTL, persisted to disk between restarts"""
+
+    def __init__(self, path, max_size=5000, ttl=86400):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            now = time.time()
+            for owner_id, (name, expires_at) in data.items():
+                if expires_at > now:
+                    self.entries[int(owner_id)] = (name, expires_at)
+            logging.info(f"Author cache loaded: {len(self.entries)} entries")
+        except Exception as e:
+            logging.error(f"Failed to load author cache: {str(e)}")
+
+    def save(self):
+        """Atomically write the cache if anything changed"""
+        if not self.dirty:
+            return
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({str(k): v for k, v in self.entries.items()}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+        except Exception as e:
+            logging.error(f"Failed to save author cache: {str(e)}")
+
+    def get(self, owner_id):
+        entry = self.entries.get(owner_id)
+        if entry and entry[1] > time.time():
+            self.entries.move_to_end(owner_id)
+            self.hits += 1
+            return entry[0]
+        if entry:
+            del self.entries[owner_id]
+        self.misses += 1
+        return None
+
+    def put(self, owner_id, name):
+        entry = self.entries.get(owner_id)
+        if entry and entry[0] == name and entry[1] - time.time() > self.ttl / 2:
+            # Seen again unchanged: keep the saved expiry so the file is only rewritten for real changes
+            self.entries.move_to_end(owner_id)
+            return
+        self.entries[owner_id] = (name, time.time() + self.ttl)
+        self.entries.move_to_end(owner_id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        self.dirty = True
+
+    def seed(self, profiles=(), groups=()):
+        """Fill the cache from `profiles`/`groups` of an extended VK response"""
+        for user in profiles:
+            self.put(user['id'], f"{user['first_name']} {user['last_name']}")
+        for group in groups:
+            self.put(-group['id'], group['name'])
+
+    def stats(self):
+        return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses}
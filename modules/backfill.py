@@ -0,0 +1,194 @@
+import asyncio
+import json
+import logging
+import math
+import time
+from modules import metrics
+from modules.post_index import post_key
+from modules.vk_api_client import CATCHUP_PAGE_SIZE, HISTORY_PAGES_PER_CALL
+
+# Pages are re-read with this much overlap, so posts deleted meanwhile cannot shift one past us
+PAGE_OVERLAP = 10
+PUBLISH_BATCH_SIZE = 200
+
+BACKFILLED_POSTS = metrics.counter('vk2tg_backfilled_posts_total', "Wall history posts handled by backfill", ['action'])
+
+class Backfill:
+    """Mirrors the history of a VK wall into its Telegram destinations, oldest post first.
+
+    The wall is paged back in `execute` calls of up to 10 full pages into a spool table, then
+    published in date order as fast as the dispatcher's rate limits allow, without the publish
+    spacing. Both stages checkpoint in the state store, so an interrupted backfill resumes where
+    it stopped; the outbox keeps a post that was cut short from being sent twice.
+
+    Backfilled posts only get a message map, not an entry in the post index: they would evict
+    live posts from its bounded window and from edit sync, which only follows live posts.
+    """
+
+    def __init__(self, vk, tg, store, index, routing, pages_per_call=HISTORY_PAGES_PER_CALL,
+                 max_attempts=5, retry_delay=60):
+        self.vk = vk
+        self.tg = tg
+        self.store = store
+        self.index = index
+        self.routing = routing
+        self.pages_per_call = pages_per_call
+        self.max_attempts = max(1, max_attempts)
+        self.retry_delay = retry_delay
+
+    async def run(self, source, until, since=0, chat_id=None, dry_run=False, export_path=None):
+        """Backfill posts of `source` dated from `since` up to (not including) `until`; returns counts"""
+        collected = await self._collect(source, since, until)
+        stats = {'collected': collected, 'exported': 0, 'published': 0}
+        if export_path:
+            stats['exported'] = await self._export(source, export_path, since)
+        if dry_run:
+            logging.info(f"Dry run of wall {source}: {collected} posts would be published")
+            return stats
+
+        routes = self.routing.destinations(source)
+        if chat_id is not None:
+            routes = [self.routing.route(source, chat_id)]
+        stats['published'] = await self._publish(source, routes, since)
+        self._finish(source)
+        return stats
+
+    async def _collect(self, source, since, until):
+        """Page the wall from the newest post back to `since` into the spool; returns the posts in range.
+
+        A scan left by an earlier run is reused if it covers the range: it reached back at least
+        to `since`, and its end is at most `until` (posts past it went to the live bot meanwhile).
+        """
+        key = f'backfill:{source}'
+        state = self.store.get(key)
+        if state and not (state.get('since', math.inf) <= since and state.get('until', math.inf) <= until):
+            logging.info(f"Backfill of wall {source} covers another date range, scanning the wall again")
+            state = None
+        if state is None:
+            with self.store.transaction():
+                self.store.execute('DELETE FROM backfill_posts WHERE owner_id = ?', (source,))
+                state = {'offset': 0, 'done': False, 'since': since, 'until': until}
+                self.store.set(key, state)
+        scan_since, until = state['since'], state['until']
+        requested = self.pages_per_call * CATCHUP_PAGE_SIZE
+        while not state['done']:
+            posts = await self.vk.get_wall_history(source, state['offset'], self.pages_per_call)
+            with self.store.transaction():
+                for post in posts:
+                    if scan_since <= post['date'] < until:
+                        self.store.execute(
+                            'INSERT OR IGNORE INTO backfill_posts (owner_id, post_id, date, post) VALUES (?, ?, ?, ?)',
+                            (post['owner_id'], post['id'], post['date'], json.dumps(post, ensure_ascii=False))
+                        )
+                # The last post of a page is the oldest one; only a pinned post is out of order
+                state['done'] = len(posts) < requested or posts[-1]['date'] < scan_since
+                state['offset'] += max(1, len(posts) - PAGE_OVERLAP)
+                self.store.set(key, state)
+            logging.info(f"Backfill of wall {source}: {state['offset']} posts scanned")
+        return self.store.query(
+            'SELECT COUNT(*) FROM backfill_posts WHERE owner_id = ? AND date >= ?', (source, since)
+        )[0][0]
+
+    def _spooled(self, source, since, after=(0, 0)):
+        """Spooled posts from `since` on in publishing order, read in batches"""
+        while True:
+            rows = self.store.query(
+                'SELECT date, post_id, post FROM backfill_posts WHERE owner_id = ? AND date >= ? '
+                'AND (date, post_id) > (?, ?) ORDER BY date, post_id LIMIT ?',
+                (source, since, *after, PUBLISH_BATCH_SIZE)
+            )
+            if not rows:
+                return
+            yield [json.loads(row[2]) for row in rows]
+            after = rows[-1][:2]
+
+    async def _export(self, source, path, since):
+        """Write the spooled posts to a JSONL archive with the names of the walls they mention"""
+        exported = 0
+        with open(path, 'w', encoding='utf-8') as f:
+            for posts in self._spooled(source, since):
+                names = await self.vk.resolve_authors(self._owners(posts))
+                for post in posts:
+                    authors = {owner_id: names[owner_id] for owner_id in self._owners([post]) if owner_id in names}
+                    f.write(json.dumps({**post, 'authors': authors}, ensure_ascii=False) + '\n')
+                    BACKFILLED_POSTS.inc(action='exported')
+                exported += len(posts)
+        logging.info(f"Exported {exported} posts of wall {source} to {path}")
+        return exported
+
+    def _owners(self, posts):
+        owners = set()
+        for post in posts:
+            owners.update(item[field] for item in [post, *post.get('copy_history', [])]
+                          for field in ('owner_id', 'from_id') if item.get(field))
+        return owners
+
+    async def _publish(self, source, routes, since):
+        """Publish spooled posts in date order, each chat picking up after its own checkpoint"""
+        checkpoints = {
+            route.chat_id: tuple(self.store.get(f'backfill:{source}:{route.chat_id}', (0, 0))) for route in routes
+        }
+        published = 0
+        started = time.time()
+        for posts in self._spooled(source, since, min(checkpoints.values(), default=(0, 0))):
+            # Repost authors of the whole batch in one lookup instead of one per post
+            await self.vk.resolve_authors([
+                repost['owner_id'] for post in posts for repost in post.get('copy_history', []) if repost.get('owner_id')
+            ])
+            for post in posts:
+                position = (post['date'], post['id'])
+                due = []
+                for route in routes:
+                    if checkpoints[route.chat_id] >= position:
+                        continue
+                    if route.accepts(post) and not self.index.get_messages(post_key(post), route.chat_id):
+                        due.append(route)
+                    else:
+                        # Filtered out, or its message map shows it already went there
+                        self._checkpoint(source, route.chat_id, position, checkpoints)
+                if not due:
+                    continue
+                if await self._publish_post(source, post, due, position, checkpoints):
+                    published += 1
+                    BACKFILLED_POSTS.inc(action='published')
+            logging.info(f"Backfill of wall {source}: {published} posts published ({published / max(1, time.time() - started):.1f}/s)")
+        return published
+
+    async def _publish_post(self, source, post, routes, position, checkpoints):
+        """Publish to all routes, retrying failed chats; the outbox resumes each where it stopped.
+
+        Returns False if every chat failed up to the last attempt.
+        """
+        pending = len(routes)
+        for attempt in range(1, self.max_attempts + 1):
+            results = await self.tg.process_post(post, routes, best_effort=attempt == self.max_attempts)
+            with self.store.transaction():
+                for route in routes:
+                    ctx = results[route.chat_id]
+                    if not ctx.error:
+                        self.index.set_messages(post_key(post), route.chat_id, ctx.message_ids, ctx.layout)
+                        self._checkpoint(source, route.chat_id, position, checkpoints)
+            routes = [route for route in routes if results[route.chat_id].error]
+            if not routes:
+                return True
+            if attempt == self.max_attempts:
+                break
+            delay = min(3600, self.retry_delay * 2 ** (attempt - 1))
+            logging.warning(f"Backfill of post {source}_{post['id']} failed, attempt {attempt + 1}/{self.max_attempts} in {delay}s")
+            await asyncio.sleep(delay)
+        for route in routes:
+            # Later posts move the checkpoint past this one, as the live scheduler drops it too
+            logging.error(f"Giving up on post {source}_{post['id']} for {route.chat_id}")
+            BACKFILLED_POSTS.inc(action='failed')
+        return len(routes) < pending
+
+    def _checkpoint(self, source, chat_id, position, checkpoints):
+        checkpoints[chat_id] = position
+        self.store.set(f'backfill:{source}:{chat_id}', list(position))
+
+    def _finish(self, source):
+        """Drop the spool of a completed backfill; chat checkpoints stay, so a rerun only adds what is new"""
+        with self.store.transaction():
+            self.store.execute('DELETE FROM backfill_posts WHERE owner_id = ?', (source,))
+            self.store.execute('DELETE FROM kv WHERE key = ?', (f'backfill:{source}',))
+        logging.info(f"Backfill of wall {source} complete")
@@ -1,15 +1,15 @@
 import json
 import os
-import time
 import logging
 
 class ConfigHandler:
-    def __init__(self, config_path=None):
+    def __init__(self, config_path=None, data_dir=None):
         """Initialize configuration handler"""
         self.config_path = config_path or os.path.join(
             os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
             'config.json'
         )
+        self.data_dir = data_dir
         self.config = self._load_config()
         logging.info('Configuration loaded successfully')
 
@@ -20,7 +20,6 @@ class ConfigHandler:
             "tg_channel_id": "",
             "tg_bot_token": "",
             "vk_access_token": "",
-            "last_post_date": time.time(),
             "log_level": "INFO"
         }
 
@@ -35,17 +34,26 @@ class ConfigHandler:
                 config = json.load(f)
                 return {**default_config, **config}
         except Exception as e:
+            # Never fall back to defaults here: the next save() would overwrite the broken file
             logging.error(f'Failed to load config: {str(e)}')
-            return default_config
+            raise
 
     def save(self):
-        """Save current configuration to file"""
+        """Atomically save current configuration to file"""
+        tmp_path = f"{self.config_path}.tmp"
         try:
-            with open(self.config_path, 'w', encoding='utf-8') as f:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
                 json.dump(self.config, f, indent=4, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.config_path)
         except Exception as e:
             logging.error(f'Failed to save config: {str(e)}')
 
+    def data_path(self, filename):
+        """Path for a runtime data file, stored next to the config unless a data_dir is given"""
+        return os.path.join(self.data_dir or os.path.dirname(os.path.abspath(self.config_path)), filename)
+
     def get(self, key, default=None):
         """Get configuration value by key"""
         return self.config.get(key, default)
@@ -0,0 +1,49 @@
+import logging
+import os
+import tempfile
+
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+class FileTooLarge(Exception):
+    def __init__(self, size, limit):
+        super().__init__(f"File size {size} exceeds limit {limit}")
+        self.size = size
+        self.limit = limit
+
+async def spool_to_file(session, url, max_bytes, timeout=300, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """Download `url` chunk by chunk into a temporary file, never holding more than one chunk in memory.
+
+    Raises FileTooLarge as soon as the announced or received size passes `max_bytes`.
+    The caller owns the returned path and must remove it.
+    """
+    fd, path = tempfile.mkstemp(prefix='vk2tg-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            async with session.get(url, timeout=timeout, raise_for_status=True) as response:
+                if response.content_length and response.content_length > max_bytes:
+                    raise FileTooLarge(response.content_length, max_bytes)
+                received = 0
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    received += len(chunk)
+                    if received > max_bytes:
+                        raise FileTooLarge(received, max_bytes)
+                    f.write(chunk)
+        logging.debug(f"Spooled {received} bytes to {path}")
+        return path
+    except BaseException:
+        os.remove(path)
+        raise
+
+class PreparedFile:
+    """Upload-ready attachment, optionally backed by a spooled temporary file"""
+
+    def __init__(self, filename, input_file=None, path=None, oversize=None):
+        self.filename = filename
+        self.input_file = input_file
+        self.path = path
+        self.oversize = oversize
+
+    def cleanup(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+        self.path = None
@@ -0,0 +1,81 @@
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+def media_key(att_type, data):
+    """Stable key of a VK attachment: `photo{owner_id}_{id}`, or a URL hash when VK gives no id"""
+    if data.get('id') is not None and data.get('owner_id') is not None:
+        return f"{att_type}{data['owner_id']}_{data['id']}"
+    if url := data.get('url'):
+        parts = urlsplit(url)
+        return f"{att_type}:{hashlib.sha1((parts.netloc + parts.path).encode()).hexdigest()}"
+    return None
+
+class FileIdCache:
+    """Bounded LRU map from VK media keys to Telegram file_ids, persisted in the state store"""
+
+    def __init__(self, store=None, max_size=20000):
+        self.store = store
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        if self.store is None:
+            return
+        rows = self.store.query('SELECT key, file_id FROM file_ids ORDER BY used_at DESC LIMIT ?', (self.max_size,))
+        for key, file_id in reversed(rows):
+            self.entries[key] = file_id
+        logging.info(f"File id cache loaded: {len(self.entries)} entries")
+
+    def get(self, key):
+        if key is not None and key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        self.misses += 1
+        return None
+
+    def peek(self, key):
+        return self.entries.get(key)
+
+    def put(self, key, file_id):
+        if key is None or not file_id:
+            return
+        self.entries[key] = file_id
+        self.entries.move_to_end(key)
+        if self.store is None:
+            self._evict()
+            return
+        with self.store.transaction():
+            self.store.execute(
+                'INSERT INTO file_ids (key, file_id, used_at) VALUES (?, ?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET file_id = excluded.file_id, used_at = excluded.used_at',
+                (key, file_id, time.time())
+            )
+            self._evict()
+
+    def discard(self, key):
+        """Forget a file_id Telegram no longer accepts"""
+        self.entries.pop(key, None)
+        if self.store is not None:
+            self.store.execute('DELETE FROM file_ids WHERE key = ?', (key,))
+
+    def _evict(self):
+        while len(self.entries) > self.max_size:
+            key, _ = self.entries.popitem(last=False)
+            if self.store is not None:
+                self.store.execute('DELETE FROM file_ids WHERE key = ?', (key,))
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
@@ -0,0 +1,113 @@
+import re
+from functools import lru_cache
+
+CAPTION_LIMIT = 1024
+MESSAGE_LIMIT = 4096
+
+# [id1|Name], [club1|Name], [public1|Name], [event1|Name] and [https://...|text] / [vk.com/...|text]
+VK_LINK_RE = re.compile(r'\[((?:id|club|public|event)\d+|https?://[^\s|\]]+|(?:m\.)?vk\.com/[^\s|\]]+)\|([^\]\n]+)\]')
+WORD_RE = re.compile(r'\S+\s*|\s+')
+MARKDOWN_SPECIAL_RE = re.compile(r'([_*\[\]()~`>#+\-=|{}.!\\])')
+URL_SPECIAL_RE = re.compile(r'([)\\])')
+
+def escape(text):
+    """Escape text for MarkdownV2"""
+    return MARKDOWN_SPECIAL_RE.sub(r'\\\1', text)
+
+def mention(owner_id, name):
+    """VK markup link to a user or community; brackets in the name would end the link early"""
+    return f"[{'club' if owner_id < 0 else 'id'}{abs(owner_id)}|{name.replace(']', ')')}]"
+
+def _utf16_len(text):
+    # Telegram counts message limits in UTF-16 code units
+    return len(text.encode('utf-16-le')) // 2
+
+def _link_url(target):
+    if target.startswith(('http://', 'https://')):
+        return target
+    if target.startswith(('vk.com/', 'm.vk.com/')):
+        return f"https://{target}"
+    return f"https://vk.com/{target}"
+
+def tokenize(text):
+    """Split VK text into (visible, markdown, length) tokens in one pass.
+
+    Plain text becomes one token per word with its trailing whitespace, so chunks can be cut
+    between any two tokens; links are single tokens and are never split.
+    """
+    tokens = []
+    position = 0
+    for match in VK_LINK_RE.finditer(text):
+        _add_plain(tokens, text[position:match.start()])
+        target, label = match.groups()
+        url = URL_SPECIAL_RE.sub(r'\\\1', _link_url(target))
+        tokens.append((label, f"[{escape(label)}]({url})", _utf16_len(label)))
+        position = match.end()
+    _add_plain(tokens, text[position:])
+    return tuple(tokens)
+
+def _add_plain(tokens, text):
+    # Escaping never adds whitespace, so the words of the escaped run line up with the original
+    words = WORD_RE.findall(text)
+    lengths = map(len, words) if _utf16_len(text) == len(text) else map(_utf16_len, words)
+    tokens.extend(zip(words, WORD_RE.findall(escape(text)), lengths))
+
+def visible_length(text):
+    return sum(token[2] for token in tokenize(text))
+
+@lru_cache(maxsize=256)
+def split(text, first_limit=MESSAGE_LIMIT, limit=MESSAGE_LIMIT):
+    """Render VK text as a tuple of MarkdownV2 chunks: the first fits `first_limit`, the rest `limit`.
+
+    Limits apply to the visible text. Cuts prefer the last line break in the second half of a
+    chunk, then the last word boundary; only a single word longer than a whole chunk is cut
+    inside, and links are kept whole. Cached because fan-out formats a post once per route.
+    """
+    chunks = []
+    current, size, last_break = [], 0, None
+    chunk_limit = first_limit
+
+    def flush(upto):
+        nonlocal current, size, last_break, chunk_limit
+        rendered = ''.join(token[1] for token in current[:upto]).strip()
+        if rendered:
+            chunks.append(rendered)
+            chunk_limit = limit
+        current = current[upto:]
+        size = sum(token[2] for token in current)
+        last_break = None
+
+    pending = list(reversed(tokenize(text)))
+    while pending:
+        token = pending.pop()
+        if size + token[2] <= chunk_limit:
+            current.append(token)
+            size += token[2]
+            if '\n' in token[0]:
+                last_break = len(current)
+            continue
+
+        if current:
+            pending.append(token)
+            if last_break is not None and sum(t[2] for t in current[:last_break]) > chunk_limit // 2:
+                flush(last_break)
+            else:
+                flush(len(current))
+        else:
+            # A single word (or link label) longer than a whole chunk: cut it as plain text
+            head, tail = _cut(token[0], chunk_limit)
+            current.append((head, escape(head), _utf16_len(head)))
+            flush(1)
+            pending.append((tail, escape(tail), _utf16_len(tail)))
+    flush(len(current))
+    return tuple(chunks)
+
+def _cut(text, limit):
+    if _utf16_len(text) == len(text):
+        return text[:limit], text[limit:]
+    size = 0
+    for i, char in enumerate(text):
+        size += 2 if ord(char) > 0xFFFF else 1
+        if size > limit:
+            return text[:i], text[i:]
+    return text, ''
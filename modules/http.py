@@ -0,0 +1,52 @@
+import logging
+import aiohttp
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+class HttpPool:
+    """One keep-alive connection pool for all outbound HTTP: VK API, file downloads and the Bot API.
+
+    Connections are reused across calls and resolved host names cached, so a request only pays
+    the TCP and TLS handshakes when the pool has no idle connection to that host. The session is
+    opened lazily, inside the event loop, and must be closed by whoever created the pool.
+    """
+
+    def __init__(self, limit=100, limit_per_host=0, dns_ttl=300, keepalive=30):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_ttl = dns_ttl
+        self.keepalive = keepalive
+        self._session = None
+
+    def session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.dns_ttl,
+                keepalive_timeout=self.keepalive
+            ))
+            logging.debug(f"HTTP pool opened: {self.limit} connections, DNS cached for {self.dns_ttl}s")
+        return self._session
+
+    def bot_session(self, api_url=None):
+        """aiogram session for a Bot API server that sends through this pool"""
+        return PooledBotSession(self, api=TelegramAPIServer.from_base(api_url)) if api_url else PooledBotSession(self)
+
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+class PooledBotSession(AiohttpSession):
+    """AiohttpSession borrowing the connections of an HttpPool; closing it leaves the pool open"""
+
+    def __init__(self, pool, **kwargs):
+        super().__init__(**kwargs)
+        self.pool = pool
+
+    async def create_session(self):
+        return self.pool.session()
+
+    async def close(self):
+        pass
@@ -0,0 +1,137 @@
+import asyncio
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from modules.downloads import spool_to_file
+from modules.file_id_cache import media_key
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+TG_PHOTO_MAX_BYTES = 10 * 1024 * 1024
+TG_PHOTO_MAX_DIMENSIONS = 10000
+SOURCE_MAX_BYTES = 50 * 1024 * 1024
+
+def pick_size(sizes, target_side):
+    """Smallest VK size whose longer side reaches `target_side`, else the largest one"""
+    sizes = [size for size in sizes if size.get('url')]
+    if not sizes:
+        return None
+    largest = max(sizes, key=lambda size: size.get('width', 0) * size.get('height', 0))
+    if not largest.get('width'):
+        # Old photos may list sizes without dimensions; there is nothing to compare then
+        return sizes[-1]
+    fitting = [size for size in sizes if max(size['width'], size['height']) >= target_side]
+    return min(fitting, key=lambda size: size['width'] * size['height']) if fitting else largest
+
+def within_limits(size):
+    return size.get('width', 0) + size.get('height', 0) <= TG_PHOTO_MAX_DIMENSIONS
+
+def _downscale(src, dst, max_side, max_bytes, quality):
+    # Runs in a worker process: decoding and encoding large JPEGs would stall the event loop
+    with Image.open(src) as image:
+        image = image.convert('RGB')
+        image.thumbnail((max_side, max_side))
+        while True:
+            image.save(dst, 'JPEG', quality=quality, optimize=True)
+            if os.path.getsize(dst) <= max_bytes or quality <= 40:
+                break
+            quality -= 15
+    return os.path.getsize(dst)
+
+class ImageProcessor:
+    """Picks a right-sized VK photo and recompresses those over Telegram's limits.
+
+    Photos whose best size breaks the limits (or that Telegram rejected) are downloaded, downscaled
+    and recompressed in a process pool. Results are kept in a disk cache bounded by total size.
+    Without Pillow only the size selection is done.
+    """
+
+    def __init__(self, cache_dir, target_side=2560, max_bytes=TG_PHOTO_MAX_BYTES, quality=85,
+                 workers=2, cache_max_bytes=500 * 1024 * 1024, download_timeout=300):
+        self.cache_dir = cache_dir
+        self.target_side = target_side
+        self.max_bytes = max_bytes
+        self.quality = quality
+        self.workers = workers
+        self.cache_max_bytes = cache_max_bytes
+        self.download_timeout = download_timeout
+        self.executor = None
+        self.cache = OrderedDict()
+        self.processed = 0
+        self.cache_hits = 0
+        self.can_process = Image is not None
+        if Image is None:
+            logging.warning("Pillow is not installed, oversized photos will be sent as they are")
+        self._load()
+
+    def _load(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        files = sorted(
+            (entry for entry in os.scandir(self.cache_dir) if entry.is_file() and entry.name.endswith('.jpg')),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        for entry in files:
+            self.cache[entry.path] = entry.stat().st_size
+
+    def select(self, data):
+        """VK size to send by URL, or None if the photo has to be processed locally"""
+        size = pick_size(data.get('sizes', []), self.target_side)
+        if size and (within_limits(size) or not self.can_process):
+            return size
+        return None
+
+    def cache_path(self, data):
+        # VK photo URLs carry expiring signatures, so the cache is keyed by photo id and target size
+        key = f"{media_key('photo', data)}:{self.target_side}"
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest() + '.jpg')
+
+    async def process(self, session, data):
+        """Path of a processed copy of the photo that fits Telegram's limits"""
+        source = max(data['sizes'], key=lambda size: size.get('width', 0) * size.get('height', 0))
+        path = self.cache_path(data)
+        if path in self.cache:
+            self.cache_hits += 1
+            self.cache.move_to_end(path)
+            os.utime(path)
+            return path
+
+        src = await spool_to_file(session, source['url'], SOURCE_MAX_BYTES, timeout=self.download_timeout)
+        try:
+            tmp = f"{path}.tmp"
+            size = await asyncio.get_running_loop().run_in_executor(
+                self._get_executor(), _downscale, src, tmp, self.target_side, self.max_bytes, self.quality
+            )
+            os.replace(tmp, path)
+        finally:
+            os.remove(src)
+
+        self.processed += 1
+        self.cache[path] = size
+        self._evict()
+        logging.info(f"Photo {source.get('width')}x{source.get('height')} recompressed to {size / 1024:.0f} KB")
+        return path
+
+    def _get_executor(self):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self.executor
+
+    def _evict(self):
+        total = sum(self.cache.values())
+        while total > self.cache_max_bytes and len(self.cache) > 1:
+            path, size = self.cache.popitem(last=False)
+            total -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
@@ -0,0 +1,51 @@
+POST_FIELDS = ('id', 'owner_id', 'from_id', 'date', 'text', 'post_type')
+ATTACHMENT_FIELDS = {
+    'photo': ('id', 'owner_id'),
+    'doc': ('id', 'owner_id', 'title', 'ext', 'size', 'url'),
+    'audio': ('id', 'owner_id', 'artist', 'title', 'url'),
+    'poll': ('id', 'owner_id', 'question', 'multiple')
+}
+PHOTO_SIZE_FIELDS = ('type', 'width', 'height', 'url')
+# Thumbnails and album crops below this are never worth sending to Telegram
+MIN_PHOTO_SIDE = 600
+AUDIO_DEFAULTS = {'artist': 'Unknown Artist', 'title': 'Unknown Track'}
+
+def _pick(data, fields):
+    return {field: data[field] for field in fields if field in data}
+
+def slim_attachment(att):
+    """Attachment with only what publishing, routing and edit detection read"""
+    att_type = att['type']
+    data = att.get(att_type) or {}
+    # Types the bot does not publish still count towards the content hash by id
+    slim = _pick(data, ATTACHMENT_FIELDS.get(att_type, ('id', 'owner_id')))
+    if att_type == 'photo':
+        slim['sizes'] = [_pick(size, PHOTO_SIZE_FIELDS) for size in _useful_sizes(data.get('sizes', []))]
+    elif att_type == 'audio':
+        slim = {**AUDIO_DEFAULTS, **{k: v for k, v in slim.items() if v is not None}}
+        slim.setdefault('url', None)
+    elif att_type == 'poll':
+        slim['answers'] = [{'text': answer['text']} for answer in data.get('answers', [])]
+    return {'type': att_type, att_type: slim}
+
+def _useful_sizes(sizes):
+    if not sizes or not all(size.get('width') for size in sizes):
+        return sizes
+    largest = max(sizes, key=lambda size: size['width'] * size['height'])
+    return [
+        size for size in sizes
+        if size is largest or max(size['width'], size['height']) >= MIN_PHOTO_SIDE
+    ]
+
+def slim_post(item):
+    """Compact copy of a `wall.get` item: reposts and attachments trimmed the same way.
+
+    Posts sit in the publish queue and the fan-out pipeline as plain dicts, so the compact form
+    is a dict too; dropping photo thumbnails, likes, views and the like is most of the saving.
+    """
+    post = _pick(item, POST_FIELDS)
+    if attachments := item.get('attachments'):
+        post['attachments'] = [slim_attachment(att) for att in attachments]
+    if reposts := item.get('copy_history'):
+        post['copy_history'] = [slim_post(repost) for repost in reposts]
+    return post
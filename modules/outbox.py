@@ -0,0 +1,90 @@
+import json
+import logging
+import time
+from collections import namedtuple
+from modules import metrics
+
+OUTBOX_STEPS = metrics.counter('vk2tg_outbox_steps_total', "Planned Telegram sends by outcome", ['status'])
+
+# Stands in for a message an earlier attempt delivered: replies and edit sync only need its id
+SentMessage = namedtuple('SentMessage', 'message_id photo document audio', defaults=(None, None, None))
+
+class Outbox:
+    """Write-ahead journal of the sends that make up each post in each chat.
+
+    Every send is journaled as pending before it goes out and marked done with its message ids
+    afterwards. Publishing a post again, after a crash or a failed attempt, skips what Telegram
+    already has and resumes at the first unfinished send.
+    """
+
+    def __init__(self, store, retention_days=7):
+        self.store = store
+        with self.store.transaction():
+            self.store.execute('DELETE FROM outbox WHERE updated_at < ?', (time.time() - retention_days * 86400,))
+        interrupted = self.store.query("SELECT COUNT(*) FROM outbox WHERE status = 'pending'")[0][0]
+        if interrupted:
+            logging.warning(f"Outbox: {interrupted} sends were interrupted and will be made again")
+
+    def journal(self, post, chat_id):
+        rows = self.store.query(
+            'SELECT step, kind, status, message_ids FROM outbox WHERE owner_id = ? AND post_id = ? AND chat_id = ?',
+            (post['owner_id'], post['id'], chat_id)
+        )
+        steps = {step: (kind, status, json.loads(message_ids)) for step, kind, status, message_ids in rows}
+        return PostJournal(self.store, (post['owner_id'], post['id'], chat_id), steps)
+
+class PostJournal:
+    """Sends of one post in one chat, numbered in the order they are made"""
+
+    def __init__(self, store, key, steps):
+        self.store = store
+        self.key = key
+        self.steps = steps
+        self.step = -1
+
+    @property
+    def resuming(self):
+        return any(status == 'done' for _, status, _ in self.steps.values())
+
+    def begin(self, kind):
+        """Journal the next send as pending; returns its message ids instead if it was already done"""
+        self.step += 1
+        journaled_kind, status, message_ids = self.steps.get(self.step, (kind, None, None))
+        if journaled_kind != kind:
+            # The post no longer lays out the same way; nothing journaled from here on applies
+            logging.warning(f"Outbox of post {self.key[0]}_{self.key[1]} in {self.key[2]} does not match, sending the rest")
+            self.steps = {step: entry for step, entry in self.steps.items() if step < self.step}
+            self.store.execute(
+                'DELETE FROM outbox WHERE owner_id = ? AND post_id = ? AND chat_id = ? AND step >= ?',
+                (*self.key, self.step)
+            )
+            status = None
+        if status == 'done':
+            OUTBOX_STEPS.inc(status='skipped')
+            return message_ids
+        if status == 'pending':
+            logging.warning(
+                f"Send {self.step} ({kind}) of post {self.key[0]}_{self.key[1]} was interrupted "
+                f"and may have reached {self.key[2]}; sending it again"
+            )
+            OUTBOX_STEPS.inc(status='resent')
+        self._write(kind, 'pending', [])
+        return None
+
+    def done(self, message_ids):
+        OUTBOX_STEPS.inc(status='sent')
+        self._write(self.steps[self.step][0], 'done', message_ids)
+
+    def fail(self):
+        OUTBOX_STEPS.inc(status='failed')
+        self._write(self.steps[self.step][0], 'failed', [])
+
+    def _write(self, kind, status, message_ids):
+        self.steps[self.step] = (kind, status, message_ids)
+        self.store.execute(
+            'INSERT INTO outbox (owner_id, post_id, chat_id, step, kind, status, message_ids, updated_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(owner_id, post_id, chat_id, step) DO UPDATE SET '
+            'kind = excluded.kind, status = excluded.status, message_ids = excluded.message_ids, '
+            'updated_at = excluded.updated_at',
+            (*self.key, self.step, kind, status, json.dumps(message_ids), time.time())
+        )
@@ -0,0 +1,74 @@
+import logging
+import random
+import time
+
+RATE_LIMIT_CODES = {6, 9, 29}
+
+class AdaptivePoller:
+    """Per-source poll intervals: tighten on activity, relax when quiet, back off on errors"""
+
+    def __init__(self, sources, base=60, min_interval=15, max_interval=600, max_backoff=3600):
+        self.base = base
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.max_backoff = max_backoff
+        self.sources = {}
+        for source in sources:
+            self.add(source)
+
+    def add(self, source):
+        self.sources.setdefault(source, {'interval': self.base, 'errors': 0, 'next_poll': 0, 'suspended': False})
+
+    def remove(self, source):
+        self.sources.pop(source, None)
+
+    def suspend(self, source):
+        """Stop polling a source whose posts arrive as events"""
+        if source in self.sources:
+            self.sources[source]['suspended'] = True
+
+    def resume(self, source):
+        """Poll a suspended source again, starting right away"""
+        state = self.sources.get(source)
+        if state and state['suspended']:
+            state['suspended'] = False
+            state['next_poll'] = 0
+
+    def due(self, horizon=5):
+        """Sources to poll now; ones due within `horizon` seconds join the same batch"""
+        deadline = time.time() + horizon
+        return [
+            source for source, state in self.sources.items()
+            if not state['suspended'] and state['next_poll'] <= deadline
+        ]
+
+    def next_wakeup(self):
+        return min(
+            (state['next_poll'] for state in self.sources.values() if not state['suspended']),
+            default=time.time() + self.base
+        )
+
+    def record_success(self, source, new_posts):
+        state = self.sources[source]
+        if new_posts:
+            state['interval'] = max(self.min_interval, state['interval'] / 2)
+        else:
+            state['interval'] = min(self.max_interval, state['interval'] * 1.5)
+        state['errors'] = 0
+        state['next_poll'] = time.time() + state['interval']
+
+    def record_error(self, source, error=None):
+        """Exponential backoff with full jitter; VK rate-limit errors start one step further"""
+        state = self.sources[source]
+        state['errors'] += 1
+        exponent = state['errors'] + (1 if getattr(error, 'code', None) in RATE_LIMIT_CODES else 0)
+        ceiling = min(self.max_backoff, state['interval'] * 2 ** exponent)
+        delay = random.uniform(state['interval'], max(state['interval'], ceiling))
+        state['next_poll'] = time.time() + delay
+        logging.warning(f"Polling wall {source} backs off for {delay:.0f}s after error #{state['errors']}: {error}")
+
+    def interval(self, source):
+        return self.sources[source]['interval']
+
+    def intervals(self):
+        return {source: state['interval'] for source, state in self.sources.items()}
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+
+def post_key(post):
+    return (post['owner_id'], post['id'])
+
+def _attachment_ids(item):
+    ids = []
+    for att in item.get('attachments', []):
+        data = att.get(att['type'], {})
+        ids.append(f"{att['type']}{data.get('owner_id')}_{data.get('id')}")
+    return ids
+
+def _digest(fingerprint):
+    return hashlib.sha1(json.dumps(fingerprint, ensure_ascii=False).encode()).hexdigest()
+
+def content_hash(post):
+    """Fingerprint of what gets published: text, attachments and reposts"""
+    fingerprint = [post.get('text', ''), _attachment_ids(post)]
+    for repost in post.get('copy_history', []):
+        fingerprint += [repost.get('owner_id'), repost.get('text', ''), _attachment_ids(repost)]
+    return _digest(fingerprint)
+
+def media_hash(post):
+    """Fingerprint of everything but the post's own text, to tell text-only edits apart"""
+    fingerprint = [_attachment_ids(post)]
+    for repost in post.get('copy_history', []):
+        fingerprint += [repost.get('owner_id'), repost.get('text', ''), _attachment_ids(repost)]
+    return _digest(fingerprint)
+
+class PostIndex:
+    """Bounded index of already scheduled VK posts with content hashes and Telegram message ids"""
+
+    def __init__(self, store, max_entries=10000):
+        self.store = store
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self._load()
+
+    def _load(self):
+        rows = self.store.query(
+            'SELECT owner_id, post_id, content_hash FROM published ORDER BY seq DESC LIMIT ?',
+            (self.max_entries,)
+        )
+        for owner_id, post_id, digest in reversed(rows):
+            self.entries[(owner_id, post_id)] = digest
+        logging.info(f"Post index loaded: {len(self.entries)} entries")
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, post):
+        key = post_key(post)
+        digest = content_hash(post)
+        self.entries[key] = digest
+        self.entries.move_to_end(key)
+        with self.store.transaction():
+            self.store.execute(
+                'INSERT INTO published (owner_id, post_id, content_hash, media_hash) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(owner_id, post_id) DO UPDATE SET '
+                'content_hash = excluded.content_hash, media_hash = excluded.media_hash',
+                (*key, digest, media_hash(post))
+            )
+            self._evict()
+
+    def _evict(self):
+        while len(self.entries) > self.max_entries:
+            self._delete(self.entries.popitem(last=False)[0])
+
+    def _delete(self, key):
+        self.store.execute('DELETE FROM published WHERE owner_id = ? AND post_id = ?', key)
+        self.store.execute('DELETE FROM published_messages WHERE owner_id = ? AND post_id = ?', key)
+
+    def forget(self, key):
+        """Drop a post deleted on VK; its id is never reused, so it cannot come back as new"""
+        self.entries.pop(key, None)
+        with self.store.transaction():
+            self._delete(key)
+
+    def set_messages(self, key, chat_id, message_ids, layout=()):
+        """Remember which Telegram messages a VK post became in a chat.
+
+        `layout` lists the messages carrying the post's own text as (kind, message_id) pairs,
+        kind being 'caption' or 'text', so edits can be applied in place.
+        """
+        self.store.execute(
+            'INSERT INTO published_messages (owner_id, post_id, chat_id, message_ids, layout) VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT(owner_id, post_id, chat_id) DO UPDATE SET '
+            'message_ids = excluded.message_ids, layout = excluded.layout',
+            (*key, chat_id, json.dumps(message_ids), json.dumps(list(layout)))
+        )
+
+    def recent_published(self, limit):
+        """Newest posts that have Telegram messages: (key, content_hash, media_hash, {chat_id: (ids, layout)})"""
+        rows = self.store.query(
+            'SELECT p.owner_id, p.post_id, p.content_hash, p.media_hash, m.chat_id, m.message_ids, m.layout '
+            'FROM published p JOIN published_messages m ON m.owner_id = p.owner_id AND m.post_id = p.post_id '
+            'WHERE p.seq IN (SELECT seq FROM published ORDER BY seq DESC LIMIT ?) ORDER BY p.seq DESC',
+            (limit,)
+        )
+        posts = {}
+        for owner_id, post_id, digest, media_digest, chat_id, message_ids, layout in rows:
+            entry = posts.setdefault((owner_id, post_id), [digest, media_digest, {}])
+            entry[2][chat_id] = (json.loads(message_ids), [tuple(item) for item in json.loads(layout)])
+        return [(key, *entry) for key, entry in posts.items()]
+
+    def get_messages(self, key, chat_id):
+        rows = self.store.query(
+            'SELECT message_ids FROM published_messages WHERE owner_id = ? AND post_id = ? AND chat_id = ?',
+            (*key, chat_id)
+        )
+        return json.loads(rows[0][0]) if rows else []
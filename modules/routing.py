@@ -0,0 +1,84 @@
+import logging
+
+class Route:
+    """One Telegram destination of a VK wall, with its own filters and formatting"""
+
+    def __init__(self, chat_id, include=(), exclude=(), skip_reposts=False, attachment_types=None,
+                 header='', footer='', publish_interval=None):
+        self.chat_id = int(chat_id)
+        self.include = [word.lower() for word in include]
+        self.exclude = [word.lower() for word in exclude]
+        self.skip_reposts = skip_reposts
+        self.attachment_types = set(attachment_types) if attachment_types else None
+        self.header = header
+        self.footer = footer
+        self.publish_interval = publish_interval
+
+    @classmethod
+    def from_config(cls, value):
+        if isinstance(value, dict):
+            return cls(**value)
+        return cls(chat_id=value)
+
+    def accepts(self, post):
+        text = post.get('text', '').lower()
+        if self.include and not any(word in text for word in self.include):
+            return False
+        if any(word in text for word in self.exclude):
+            return False
+        if self.skip_reposts and post.get('copy_history') and not post.get('text') and not post.get('attachments'):
+            return False
+        return True
+
+    def prepare(self, post):
+        """Shallow copy of the post as this destination shows it; attachment dicts stay shared"""
+        prepared = dict(post)
+        text = post.get('text', '')
+        if text or self.header or self.footer:
+            prepared['text'] = '\n\n'.join(part for part in (self.header, text, self.footer) if part)
+        if self.attachment_types is not None:
+            prepared['attachments'] = [
+                att for att in post.get('attachments', []) if att['type'] in self.attachment_types
+            ]
+        if self.skip_reposts:
+            prepared['copy_history'] = []
+        return prepared
+
+class RoutingTable:
+    """Maps VK sources to their Telegram destinations (`routes` config, default `tg_channel_id`)"""
+
+    def __init__(self, routes=None, default_chat_id=None):
+        self.routes = {}
+        for source, destinations in (routes or {}).items():
+            if not isinstance(destinations, list):
+                destinations = [destinations]
+            self.routes[int(source)] = [Route.from_config(dest) for dest in destinations]
+        self.default_chat_id = default_chat_id
+
+    def destinations(self, source):
+        if source in self.routes:
+            return self.routes[source]
+        if self.default_chat_id:
+            return [Route(self.default_chat_id)]
+        logging.warning(f"No Telegram destination configured for wall {source}")
+        return []
+
+    def route(self, source, chat_id):
+        for route in self.destinations(source):
+            if route.chat_id == chat_id:
+                return route
+        return Route(chat_id)
+
+    def chat_ids(self):
+        chats = {route.chat_id for routes in self.routes.values() for route in routes}
+        if self.default_chat_id:
+            chats.add(int(self.default_chat_id))
+        return chats
+
+    def intervals(self):
+        """Per-chat publish spacing declared on routes"""
+        return {
+            route.chat_id: route.publish_interval
+            for routes in self.routes.values() for route in routes
+            if route.publish_interval is not None
+        }
@@ -0,0 +1,142 @@
+import asyncio
+import json
+import logging
+import time
+from modules import metrics
+
+QUEUE_DEPTH = metrics.gauge('vk2tg_publish_queue_depth', "Posts waiting in the publish queue", ['chat_id'])
+
+class PublishScheduler:
+    """Durable queue of posts waiting for their publish time, spaced per channel.
+
+    `publish(entries)` returns the entries that failed; those stay queued and are retried with
+    a growing delay, the last attempt publishing whatever it can.
+    """
+
+    def __init__(self, store, publish, default_interval=7200, channel_intervals=None,
+                 max_attempts=5, retry_delay=60):
+        self.store = store
+        self.publish = publish
+        self.default_interval = default_interval
+        self.channel_intervals = {str(k): v for k, v in (channel_intervals or {}).items()}
+        self.max_attempts = max(1, max_attempts)
+        self.retry_delay = retry_delay
+        self.entries = []
+        self.last_slots = {}
+        self._wakeup = asyncio.Event()
+        self._load()
+
+    def _load(self):
+        rows = self.store.query(
+            'SELECT id, source, chat_id, publish_at, post, attempts FROM publish_queue ORDER BY publish_at'
+        )
+        self.entries = [
+            {
+                'id': row[0], 'source': row[1], 'chat_id': row[2], 'publish_at': row[3],
+                'post': json.loads(row[4]), 'attempts': row[5]
+            }
+            for row in rows
+        ]
+        self.last_slots = self.store.get('last_slots', {})
+        self._report_depth({entry['chat_id'] for entry in self.entries})
+        if self.entries:
+            logging.info(f"Publish queue restored: {len(self.entries)} pending posts")
+
+    def interval(self, chat_id):
+        return self.channel_intervals.get(str(chat_id), self.default_interval)
+
+    def enqueue(self, source, post, chat_id):
+        """Schedule a post for the next free slot of its channel"""
+        last_slot = self.last_slots.get(str(chat_id))
+        publish_at = time.time() if last_slot is None else max(time.time(), last_slot + self.interval(chat_id))
+        self.last_slots[str(chat_id)] = publish_at
+
+        with self.store.transaction():
+            cursor = self.store.execute(
+                'INSERT INTO publish_queue (source, chat_id, publish_at, post) VALUES (?, ?, ?, ?)',
+                (source, chat_id, publish_at, json.dumps(post, ensure_ascii=False))
+            )
+            self.store.set('last_slots', self.last_slots)
+
+        self.entries.append({
+            'id': cursor.lastrowid,
+            'source': source,
+            'chat_id': chat_id,
+            'publish_at': publish_at,
+            'post': post,
+            'attempts': 0
+        })
+        self.entries.sort(key=lambda x: x['publish_at'])
+        self._report_depth([chat_id])
+        self._wakeup.set()
+        return publish_at
+
+    def is_last_attempt(self, entries):
+        return any(entry['attempts'] + 1 >= self.max_attempts for entry in entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    async def run(self):
+        """Publish due posts forever, independently of VK polling"""
+        while True:
+            self._wakeup.clear()
+            if not self.entries:
+                await self._wakeup.wait()
+                continue
+
+            delay = self.entries[0]['publish_at'] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # Destinations of the same post that are due together are published as one fan-out
+            head = self.entries[0]
+            now = time.time()
+            group = [
+                entry for entry in self.entries
+                if entry['publish_at'] <= now and self._same_post(entry, head)
+            ]
+            try:
+                failed = await self.publish(group) or []
+            except Exception as e:
+                logging.exception(f"Scheduled post error: {str(e)}")
+                failed = group
+            self._complete(group, {entry['id'] for entry in failed})
+
+    def _complete(self, group, failed_ids):
+        """Drop published entries from the queue and put failed ones back for a later attempt"""
+        now = time.time()
+        done = []
+        with self.store.transaction():
+            for entry in group:
+                if entry['id'] in failed_ids and entry['attempts'] + 1 < self.max_attempts:
+                    entry['attempts'] += 1
+                    entry['publish_at'] = now + min(3600, self.retry_delay * 2 ** (entry['attempts'] - 1))
+                    self.store.execute(
+                        'UPDATE publish_queue SET attempts = ?, publish_at = ? WHERE id = ?',
+                        (entry['attempts'], entry['publish_at'], entry['id'])
+                    )
+                    logging.warning(
+                        f"Post {entry['source']}_{entry['post'].get('id')} for {entry['chat_id']} failed, "
+                        f"attempt {entry['attempts'] + 1}/{self.max_attempts} in {entry['publish_at'] - now:.0f}s"
+                    )
+                    continue
+                if entry['id'] in failed_ids:
+                    logging.error(f"Giving up on post {entry['source']}_{entry['post'].get('id')} for {entry['chat_id']}")
+                self.entries.remove(entry)
+                self.store.execute('DELETE FROM publish_queue WHERE id = ?', (entry['id'],))
+                done.append(entry)
+        self.entries.sort(key=lambda x: x['publish_at'])
+        self._report_depth({entry['chat_id'] for entry in done})
+
+    def _report_depth(self, chat_ids):
+        """Set the gauge from the queue itself, so a scheduler rebuilt over the same store never counts twice"""
+        for chat_id in chat_ids:
+            QUEUE_DEPTH.set(sum(1 for entry in self.entries if entry['chat_id'] == chat_id), chat_id=chat_id)
+
+    def _same_post(self, a, b):
+        return a['source'] == b['source'] and a['post'].get('id') == b['post'].get('id')
@@ -0,0 +1,145 @@
+import json
+import logging
+import sqlite3
+from contextlib import contextmanager
+
+class StateStore:
+    """Mutable runtime state (cursors, publish queue) in SQLite WAL, kept apart from static config"""
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=FULL')
+        self._depth = 0
+        self._cursors = {}
+        self._create_tables()
+        logging.info(f"State store opened: {path}")
+
+    def _create_tables(self):
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS kv (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS cursors (
+                source INTEGER PRIMARY KEY,
+                last_post_date REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS publish_queue (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                source INTEGER NOT NULL,
+                chat_id INTEGER NOT NULL,
+                publish_at REAL NOT NULL,
+                post TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS published (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                owner_id INTEGER NOT NULL,
+                post_id INTEGER NOT NULL,
+                content_hash TEXT NOT NULL,
+                UNIQUE (owner_id, post_id)
+            );
+            CREATE TABLE IF NOT EXISTS file_ids (
+                key TEXT PRIMARY KEY,
+                file_id TEXT NOT NULL,
+                used_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS dead_letters (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER NOT NULL,
+                method TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                error TEXT NOT NULL,
+                failed_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS published_messages (
+                owner_id INTEGER NOT NULL,
+                post_id INTEGER NOT NULL,
+                chat_id INTEGER NOT NULL,
+                message_ids TEXT NOT NULL,
+                PRIMARY KEY (owner_id, post_id, chat_id)
+            );
+            CREATE TABLE IF NOT EXISTS outbox (
+                owner_id INTEGER NOT NULL,
+                post_id INTEGER NOT NULL,
+                chat_id INTEGER NOT NULL,
+                step INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL,
+                message_ids TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (owner_id, post_id, chat_id, step)
+            );
+            CREATE TABLE IF NOT EXISTS backfill_posts (
+                owner_id INTEGER NOT NULL,
+                post_id INTEGER NOT NULL,
+                date REAL NOT NULL,
+                post TEXT NOT NULL,
+                PRIMARY KEY (owner_id, post_id)
+            );
+        """)
+        self._add_column('published', 'media_hash', "TEXT NOT NULL DEFAULT ''")
+        self._add_column('published_messages', 'layout', "TEXT NOT NULL DEFAULT '[]'")
+        self._add_column('publish_queue', 'attempts', "INTEGER NOT NULL DEFAULT 0")
+        # Letters written before payloads were kept replayable stay listed but are not sent again
+        self._add_column('dead_letters', 'replayable', "INTEGER NOT NULL DEFAULT 0")
+
+    def _add_column(self, table, column, definition):
+        """Bring a table created by an older version up to date"""
+        columns = {row[1] for row in self.conn.execute(f'PRAGMA table_info({table})')}
+        if column not in columns:
+            self.conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+    @contextmanager
+    def transaction(self):
+        """Group several writes into one atomic commit; nested blocks join the outer one"""
+        if self._depth == 0:
+            self.conn.execute('BEGIN IMMEDIATE')
+        self._depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._depth -= 1
+            if self._depth == 0:
+                self.conn.execute('ROLLBACK')
+            raise
+        self._depth -= 1
+        if self._depth == 0:
+            self.conn.execute('COMMIT')
+
+    def execute(self, sql, params=()):
+        with self.transaction():
+            return self.conn.execute(sql, params)
+
+    def query(self, sql, params=()):
+        return self.conn.execute(sql, params).fetchall()
+
+    def get(self, key, default=None):
+        row = self.conn.execute('SELECT value FROM kv WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, key, value):
+        self.execute(
+            'INSERT INTO kv (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value',
+            (key, json.dumps(value, ensure_ascii=False))
+        )
+
+    def get_cursor(self, source):
+        if source not in self._cursors:
+            row = self.conn.execute('SELECT last_post_date FROM cursors WHERE source = ?', (source,)).fetchone()
+            if not row:
+                return None
+            self._cursors[source] = row[0]
+        return self._cursors[source]
+
+    def set_cursor(self, source, date):
+        self.execute(
+            'INSERT INTO cursors (source, last_post_date) VALUES (?, ?) '
+            'ON CONFLICT(source) DO UPDATE SET last_post_date = excluded.last_post_date',
+            (source, date)
+        )
+        self._cursors[source] = date
+
+    def close(self):
+        self.conn.close()
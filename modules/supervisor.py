@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+import zlib
+from modules import metrics
+from modules.http import HttpPool
+
+# A tenant that ran this long before failing counts as healthy: its restart backoff starts over
+HEALTHY_UPTIME = 300
+
+def tenant_data_dir(config_path):
+    """Where the supervisor keeps the state of the tenant run from a config file"""
+    name = os.path.splitext(os.path.basename(config_path))[0]
+    return os.path.join(os.path.dirname(os.path.abspath(config_path)), 'data', name)
+
+class Tenant:
+    def __init__(self, path, mtime):
+        self.path = path
+        self.name = os.path.splitext(os.path.basename(path))[0]
+        self.mtime = mtime
+        self.task = None
+        self.failures = 0
+
+class Supervisor:
+    """Runs every bot config of a directory in one event loop with a shared connection pool.
+
+    Each tenant keeps its own state store, cursors and poll backoff; a crash restarts only that
+    tenant. Config files are rescanned periodically, so tenants can be added, changed or removed
+    without a restart. With several worker processes each one owns a stable shard of the files.
+    """
+
+    def __init__(self, config_dir, tenant_factory, shard=0, shards=1, scan_interval=10, pool_size=100,
+                 metrics_port=None):
+        self.config_dir = config_dir
+        self.tenant_factory = tenant_factory
+        self.shard = shard
+        self.shards = shards
+        self.scan_interval = scan_interval
+        self.pool_size = pool_size
+        self.metrics_port = metrics_port
+        self.tenants = {}
+        self.http = HttpPool(limit=pool_size)
+
+    def _owns(self, name):
+        return zlib.crc32(name.encode()) % self.shards == self.shard
+
+    def _config_files(self):
+        files = {}
+        for entry in os.scandir(self.config_dir):
+            if entry.is_file() and entry.name.endswith('.json') and self._owns(entry.name):
+                files[entry.path] = entry.stat().st_mtime
+        return files
+
+    def _scan(self):
+        files = self._config_files()
+        for path in list(self.tenants):
+            if path not in files:
+                logging.info(f"Tenant {self.tenants[path].name} removed")
+                self._stop(path)
+            elif files[path] != self.tenants[path].mtime:
+                logging.info(f"Tenant {self.tenants[path].name} changed, restarting")
+                self._stop(path)
+        for path, mtime in files.items():
+            if path not in self.tenants:
+                self._start(Tenant(path, mtime))
+
+    def _start(self, tenant):
+        logging.info(f"Starting tenant {tenant.name}")
+        tenant.task = asyncio.create_task(self._run_tenant(tenant))
+        self.tenants[tenant.path] = tenant
+
+    def _stop(self, path):
+        tenant = self.tenants.pop(path)
+        tenant.task.cancel()
+
+    async def _run_tenant(self, tenant):
+        data_dir = tenant_data_dir(tenant.path)
+        os.makedirs(data_dir, exist_ok=True)
+        while True:
+            started = time.monotonic()
+            try:
+                bot = self.tenant_factory(tenant.path, data_dir=data_dir, supervisor=self)
+                await bot.monitor()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if time.monotonic() - started >= HEALTHY_UPTIME:
+                    tenant.failures = 0
+                tenant.failures += 1
+                delay = min(300, 2 ** tenant.failures)
+                logging.exception(f"Tenant {tenant.name} failed ({str(e)}), restarting in {delay}s")
+                await asyncio.sleep(delay)
+
+    async def run(self):
+        logging.info(f"Supervisor shard {self.shard + 1}/{self.shards} watching {self.config_dir}")
+        metrics_runner = None
+        if self.metrics_port:
+            # Each shard process has its own registry, so shards serve consecutive ports
+            metrics_runner = await metrics.start_server(self.metrics_port + self.shard)
+        try:
+            while True:
+                self._scan()
+                await asyncio.sleep(self.scan_interval)
+        finally:
+            tasks = [tenant.task for tenant in self.tenants.values()]
+            for path in list(self.tenants):
+                self._stop(path)
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if metrics_runner:
+                await metrics_runner.cleanup()
+            await self.http.close()
+
+def _worker(config_dir, tenant_factory, shard, shards, setup, kwargs):
+    setup()
+    supervisor = Supervisor(config_dir, tenant_factory, shard=shard, shards=shards, **kwargs)
+    try:
+        asyncio.run(supervisor.run())
+    except KeyboardInterrupt:
+        pass
+
+def run_shards(config_dir, tenant_factory, workers, setup, **kwargs):
+    """Spread tenants over `workers` processes by hashing config file names"""
+    if workers <= 1:
+        _worker(config_dir, tenant_factory, 0, 1, setup, kwargs)
+        return
+
+    processes = [
+        multiprocessing.Process(target=_worker, args=(config_dir, tenant_factory, shard, workers, setup, kwargs))
+        for shard in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+            process.join()
@@ -0,0 +1,71 @@
+import asyncio
+import logging
+from modules import metrics
+from modules.post_index import content_hash, media_hash
+
+SYNCED_POSTS = metrics.counter('vk2tg_synced_posts_total', "Published posts changed on VK", ['action'])
+
+class PostSync:
+    """Mirrors edits and deletions of recently published VK posts into their Telegram messages.
+
+    Every `interval` seconds the newest `max_posts` published posts are re-fetched in
+    `wall.getById` batches and compared by content hash. Text-only edits are applied in place
+    with edit_message_text/edit_message_caption; posts gone from VK are deleted. Changed
+    attachments cannot be edited into existing albums and are only logged.
+    """
+
+    def __init__(self, vk, tg, index, routing, interval=600, max_posts=200):
+        self.vk = vk
+        self.tg = tg
+        self.index = index
+        self.routing = routing
+        self.interval = interval
+        self.max_posts = max_posts
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sync_once()
+            except Exception as e:
+                logging.exception(f"Edit sync error: {str(e)}")
+
+    async def sync_once(self):
+        published = self.index.recent_published(self.max_posts)
+        if not published:
+            return
+        current = await self.vk.get_posts_by_id([key for key, *_ in published])
+        # A wall that returned nothing may just be unreachable; never delete on that alone
+        reachable = {owner_id for owner_id, _ in current}
+
+        for key, digest, media_digest, chats in published:
+            post = current.get(key)
+            try:
+                if post is None:
+                    if key[0] in reachable:
+                        await self._delete(key, chats)
+                elif content_hash(post) != digest:
+                    if media_hash(post) == media_digest:
+                        await self._edit(key, post, chats)
+                    else:
+                        SYNCED_POSTS.inc(action='skipped')
+                        logging.warning(f"Post {key[0]}_{key[1]} changed its attachments on VK; only text edits are synced")
+                    self.index.add(post)
+            except Exception as e:
+                logging.exception(f"Sync of post {key[0]}_{key[1]} failed: {str(e)}")
+
+    async def _edit(self, key, post, chats):
+        for chat_id, (_, layout) in chats.items():
+            text = self.routing.route(key[0], chat_id).prepare(post).get('text', '')
+            if layout and await self.tg.edit_text(chat_id, layout, text):
+                logging.info(f"Post {key[0]}_{key[1]} edited in {chat_id}")
+            else:
+                logging.warning(f"Edited post {key[0]}_{key[1]} no longer fits its messages in {chat_id}, left as is")
+        SYNCED_POSTS.inc(action='edit')
+
+    async def _delete(self, key, chats):
+        for chat_id, (message_ids, _) in chats.items():
+            await self.tg.delete_messages(chat_id, message_ids)
+            logging.info(f"Post {key[0]}_{key[1]} deleted on VK, removed {len(message_ids)} messages from {chat_id}")
+        self.index.forget(key)
+        SYNCED_POSTS.inc(action='delete')
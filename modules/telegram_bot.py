@@ -1,50 +1,203 @@
-import requests
 from aiogram import Bot
-from aiogram.types import InputMediaPhoto, BufferedInputFile, URLInputFile
-import logging
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import InputMediaPhoto, FSInputFile, URLInputFile
 import asyncio
-from datetime import datetime, timedelta
+import logging
+from datetime import datetime
+from functools import partial
 import re
-from collections import deque
+from modules.attachment_pipeline import AttachmentPipeline
+from modules.downloads import FileTooLarge, PreparedFile, spool_to_file
+from modules.file_id_cache import FileIdCache, media_key
+from modules.image_processor import ImageProcessor
+from modules.outbox import Outbox, SentMessage
+from modules import metrics
+from modules import formatter
+from modules.routing import Route
+from modules.tg_dispatcher import DeliveryError, TelegramDispatcher
+
+TG_MAX_UPLOAD_BYTES = 50 * 1024 * 1024
+MEDIA_GROUP_LIMIT = 10
+
+PROCESS_POST_SECONDS = metrics.histogram('vk2tg_process_post_seconds', "Duration of publishing a post to all its routes")
+POSTS_PUBLISHED = metrics.counter('vk2tg_posts_published_total', "Posts published per destination", ['status'])
+ATTACHMENTS = metrics.counter('vk2tg_attachments_total', "Attachments handled per destination", ['type'])
+
+class PostContext:
+    """State of publishing one post to one chat: shared prefetches, the outbox journal and the messages sent so far"""
+
+    def __init__(self, pipeline, chat_id, journal=None, best_effort=False):
+        self.pipeline = pipeline
+        self.chat_id = chat_id
+        self.journal = journal
+        # Last attempt: skip sends that keep failing instead of giving up on the whole post
+        self.best_effort = best_effort
+        self.messages = []
+        # (kind, message_id) of the messages holding the post's own text, for edit sync
+        self.layout = []
+        self.error = None
+        self._in_step = False
 
-class PostQueue:
-    def __init__(self, max_size=3):
-        self.queue = deque(maxlen=max_size)
-        self.last_publication = None
+    @property
+    def message_ids(self):
+        return [message.message_id for message in self.messages]
 
-    def add_post(self, post):
-        self.queue.append(post)
-    
-    def get_posts(self):
-        return list(self.queue)
+    def record(self, message):
+        if message:
+            self.messages.append(message)
+        return message
+
+    async def step(self, kind, send):
+        """Make one planned send through the outbox; returns the messages it produced.
+
+        A send an earlier attempt already delivered is not made again, its journaled messages stand in.
+        """
+        start = len(self.messages)
+        if self._in_step:
+            # Part of an enclosing send, like the link that replaces an oversized document
+            await send()
+            return self.messages[start:]
 
-    def clear(self):
-        self.queue.clear()
+        if self.journal and (done := self.journal.begin(kind)) is not None:
+            self.messages += [SentMessage(message_id) for message_id in done]
+            return self.messages[start:]
+
+        self._in_step = True
+        try:
+            await send()
+        except Exception as e:
+            if not self.best_effort:
+                if self.journal:
+                    self.journal.fail()
+                raise
+            logging.exception(f"Giving up on a {kind} for {self.chat_id}, publishing the rest of the post: {str(e)}")
+        finally:
+            self._in_step = False
+        if self.journal:
+            self.journal.done(self.message_ids[start:])
+        return self.messages[start:]
 
 class TelegramPoster:
-    def __init__(self, config, vk_client):
+    def __init__(self, config, vk_client, store=None, session=None):
         self.config = config
         self.vk_client = vk_client
-        self.bot = Bot(token=self.config.get('tg_bot_token'))
-        self.post_queue = PostQueue()
+        self.bot = Bot(token=self.config.get('tg_bot_token'), session=session or self._create_session())
+        self.dispatcher = TelegramDispatcher(
+            store,
+            global_rate=self.config.get('tg_global_rate', 30),
+            chat_rate=self.config.get('tg_chat_rate', 20 / 60),
+            chat_burst=self.config.get('tg_chat_burst', 20),
+            max_retries=self.config.get('tg_max_retries', 5),
+            retention_days=self.config.get('dead_letter_retention_days', 30)
+        )
         self.no_posts_reported = False
+        self.max_upload_bytes = self.config.get('tg_max_upload_bytes', TG_MAX_UPLOAD_BYTES)
+        self.oversize_policy = self.config.get('oversize_documents', 'link')
+        self.download_timeout = self.config.get('download_timeout', 300)
+        self.attachment_concurrency = self.config.get('attachment_concurrency', 4)
+        self.file_ids = FileIdCache(store, max_size=self.config.get('file_id_cache_size', 20000))
+        self.images = self._create_image_processor()
+        self.outbox = Outbox(store, retention_days=self.config.get('outbox_retention_days', 7)) if store else None
         logging.info('Telegram bot initialized')
 
-    async def process_post(self, post):
+    def _create_session(self):
+        if api_url := self.config.get('tg_api_url'):
+            return AiohttpSession(api=TelegramAPIServer.from_base(api_url))
+        return AiohttpSession()
+
+    def _create_image_processor(self):
+        if not self.config.get('image_processing'):
+            return None
+        return ImageProcessor(
+            self.config.get('image_cache_dir') or self.config.data_path('image_cache'),
+            target_side=self.config.get('photo_target_side', 2560),
+            quality=self.config.get('photo_quality', 85),
+            workers=self.config.get('image_workers', 2),
+            cache_max_bytes=self.config.get('image_cache_max_mb', 500) * 1024 * 1024,
+            download_timeout=self.download_timeout
+        )
+
+    async def close(self):
+        """Release the image workers and the Bot API session; a pooled session leaves its pool open"""
+        if self.images:
+            self.images.close()
+        await self.bot.session.close()
+
+    async def replay_dead_letters(self, ids=None):
+        """Send given-up Bot API calls again; returns (sent, failed)"""
+        return await self.dispatcher.replay(self.bot, ids)
+
+    async def process_post(self, post, routes=None, best_effort=False):
+        """Publish a post to all routes concurrently; returns the PostContext of each chat.
+
+        Destinations share one attachment pipeline, so every file is downloaded once and
+        uploaded once, later destinations reusing the file_id of the first upload. A chat whose
+        publishing failed has the error in `ctx.error`; publishing the post there again resumes
+        after the sends its outbox journal already has.
+        """
+        with PROCESS_POST_SECONDS.time():
+            return await self._process_post(post, routes or [Route(self.config.get('tg_channel_id'))], best_effort)
+
+    async def _process_post(self, post, routes, best_effort):
+        variants = [route.prepare(post) for route in routes]
+        pipeline = AttachmentPipeline(self._prepare_attachment, self.attachment_concurrency)
+        contexts = [
+            PostContext(
+                pipeline, route.chat_id,
+                journal=self.outbox.journal(post, route.chat_id) if self.outbox else None,
+                best_effort=best_effort
+            )
+            for route in routes
+        ]
+        try:
+            downloads = self._downloadable_attachments(variants)
+            # A resumed post downloads lazily, only what its remaining sends need
+            resuming = any(ctx.journal and ctx.journal.resuming for ctx in contexts)
+            if downloads and not resuming and (len(downloads) > 1 or len(routes) > 1) and self.attachment_concurrency > 1:
+                pipeline.prefetch(downloads)
+            await asyncio.gather(*(self._publish_to(variant, ctx) for variant, ctx in zip(variants, contexts)))
+        finally:
+            await pipeline.close()
+        logging.debug(f"File id cache stats: {self.file_ids.stats()}")
+        return {ctx.chat_id: ctx for ctx in contexts}
+
+    async def _publish_to(self, post, ctx):
+        for source in [post, *post.get('copy_history', [])]:
+            for att in source.get('attachments', []):
+                ATTACHMENTS.inc(type=att['type'])
         try:
-            main_message = await self._process_main_post(post)
-            await self._process_reposts(post, main_message)
-            self._log_success(post)
+            main_message = await self._process_main_post(post, ctx)
+            await self._process_reposts(post, main_message, ctx)
+            self._log_success(post, ctx.chat_id)
+            POSTS_PUBLISHED.inc(status='ok')
         except Exception as e:
-            logging.exception(f"Post processing error: {str(e)}")
+            ctx.error = e
+            POSTS_PUBLISHED.inc(status='error')
+            logging.exception(f"Post processing error in {ctx.chat_id}: {str(e)}")
 
-    async def _process_main_post(self, post):
+    def _downloadable_attachments(self, posts):
+        """Documents, audio and photos to recompress still to be uploaded for any of the post variants"""
+        found = {}
+        for post in posts:
+            for source in [post, *reversed(post.get('copy_history', []))]:
+                for att in source.get('attachments', []):
+                    if att['type'] in ('doc', 'audio') and att[att['type']].get('url') \
+                            and not self.file_ids.peek(media_key(att['type'], att[att['type']])):
+                        found.setdefault(id(att), att)
+                    elif att['type'] == 'photo' and self._needs_processing(att['photo']):
+                        found.setdefault(id(att), att)
+        return list(found.values())
+
+    async def _process_main_post(self, post, ctx):
         filtered_attachments = self._filter_attachments(post.get('attachments', []))
         if post.get('text') or filtered_attachments:
             return await self._send_content(
                 text=post.get('text', ''),
                 attachments=filtered_attachments,
-                reply_to=None
+                reply_to=None,
+                ctx=ctx,
+                layout=ctx.layout
             )
         return None
 
@@ -58,150 +211,369 @@ class TelegramPoster:
                 logging.info(f"Ignoring unsupported attachment type: {att['type']}")
         return filtered
 
-    async def _process_reposts(self, post, main_message):
+    async def _process_reposts(self, post, main_message, ctx):
         reposts = post.get('copy_history', [])
+        await self.vk_client.resolve_authors([r['owner_id'] for r in reposts if r.get('owner_id')])
         for repost in reversed(reposts):
             if not repost.get('owner_id'):
                 continue
                 
-            await self._send_repost_content(repost, main_message)
+            await self._send_repost_content(repost, main_message, ctx)
 
-    async def _send_repost_content(self, repost, main_message):
-        author = self.vk_client.get_author_name(repost['owner_id'])
-        author_link = f"[{author}]({self._get_author_link(repost['owner_id'])})"
+    async def _send_repost_content(self, repost, main_message, ctx):
+        author = await self.vk_client.get_author_name(repost['owner_id'])
         
         if repost_text := repost.get('text', ''):
-            await self._send_text(repost_text, main_message.message_id if main_message else None)
+            await self._send_text(repost_text, main_message.message_id if main_message else None, ctx)
         
-        caption = f"↘️ Repost from {author_link}"
+        caption = f"↘️ Repost from {formatter.mention(repost['owner_id'], author)}"
         await self._send_content(
             text=caption,
             attachments=self._filter_attachments(repost.get('attachments', [])),
-            reply_to=main_message.message_id if main_message else None
+            reply_to=main_message.message_id if main_message else None,
+            ctx=ctx
         )
 
-    def _get_author_link(self, owner_id):
-        return f"https://vk.com/{'club' if owner_id < 0 else 'id'}{abs(owner_id)}"
-
-    async def _send_content(self, text, attachments, reply_to):
-        media_group = []
+    async def _send_content(self, text, attachments, reply_to, ctx, layout=None):
+        """Photos carry the first part of the text as caption, the rest follows as replies to them"""
+        photos = [att for att in attachments if att['type'] == 'photo']
         message = None
-        
-        for att in attachments:
-            media = self._process_attachment(att)
-            if media:
-                media_group.append(media)
 
-        if len(text) > 1024 or (not media_group and text):
-            message = await self._send_text(text, reply_to)
-        elif media_group:
-            message = await self._send_media_group(text, media_group, reply_to)
+        if photos:
+            caption, *rest = formatter.split(text, formatter.CAPTION_LIMIT) or [None]
+            message = await self._send_media_group(caption, photos, reply_to, ctx)
+            if layout is not None and message and caption:
+                layout.append(('caption', message.message_id))
+            if rest:
+                await self._send_chunks(rest, message.message_id if message else reply_to, ctx, layout)
+        elif text:
+            message = await self._send_text(text, reply_to, ctx, layout)
 
-        await self._send_special_attachments(attachments, message)
+        await self._send_special_attachments(attachments, message, ctx)
         return message
 
-    def _process_attachment(self, att):
+    async def _process_attachment(self, att, ctx, caption=None, use_cache=True, reprocess=False):
         att_type = att['type']
         data = att[att_type]
         
         if att_type == 'photo':
-            best_quality = max(data['sizes'], key=lambda x: x['width'])
-            return InputMediaPhoto(media=best_quality['url'])
+            file_id = self.file_ids.get(media_key(att_type, data)) if use_cache else None
+            return InputMediaPhoto(
+                media=file_id or await self._photo_source(att, ctx, reprocess),
+                caption=caption,
+                parse_mode='MarkdownV2' if caption else None
+            )
         return None
 
-    async def _send_text(self, text, reply_to):
+    def _needs_processing(self, data):
+        return bool(self.images and self.images.can_process and not self.file_ids.peek(media_key('photo', data))
+                    and self.images.select(data) is None)
+
+    async def _photo_source(self, att, ctx, reprocess=False):
+        """URL of the VK size to send, or a locally recompressed copy when that is over Telegram's limits"""
+        data = att['photo']
+        if self.images is None:
+            return max(data['sizes'], key=lambda x: x['width'])['url']
+        if not reprocess and (size := self.images.select(data)):
+            return size['url']
+
+        prepared = await ctx.pipeline.get(att)
+        if prepared is None:
+            async with ctx.pipeline.lock(media_key('photo', data)):
+                prepared = await self._prepare_photo(data)
+        return prepared
+
+    async def _prepare_photo(self, data):
         try:
-            return await self.bot.send_message(
-                chat_id=self.config.get('tg_channel_id'),
-                text=text[:4096],
-                reply_to_message_id=reply_to,
-                parse_mode='Markdown'
-            )
+            path = await self.images.process(await self.bot.session.create_session(), data)
         except Exception as e:
-            logging.exception(f"Failed to send text: {str(e)}")
+            logging.exception(f"Photo processing failed, sending the original: {str(e)}")
+            return max(data['sizes'], key=lambda x: x.get('width', 0))['url']
+        return FSInputFile(path)
+
+    def _chunk_album(self, photos):
+        """Split into consecutive groups of at most 10, balanced so no group is left with a single photo"""
+        chunks = -(-len(photos) // MEDIA_GROUP_LIMIT)
+        size, extra = divmod(len(photos), chunks)
+        result, start = [], 0
+        for i in range(chunks):
+            end = start + size + (1 if i < extra else 0)
+            result.append(photos[start:end])
+            start = end
+        return result
 
-    async def _send_media_group(self, text, media_group, reply_to):
+    async def _send_text(self, text, reply_to, ctx, layout=None):
+        """Send VK text as one or more messages; returns the first one"""
+        return await self._send_chunks(formatter.split(text), reply_to, ctx, layout)
+
+    async def _send_chunks(self, chunks, reply_to, ctx, layout=None):
+        first_message = None
+        for chunk in chunks:
+            sent = await ctx.step('text', partial(self._send_message, chunk, reply_to, ctx))
+            if not sent:
+                continue
+            if layout is not None:
+                layout.append(('text', sent[0].message_id))
+            first_message = first_message or sent[0]
+        return first_message
+
+    async def _send_message(self, text, reply_to, ctx):
+        return ctx.record(await self.dispatcher.send(
+            self.bot.send_message,
+            ctx.chat_id,
+            text=text,
+            reply_to_message_id=reply_to,
+            parse_mode='MarkdownV2'
+        ))
+
+    async def edit_text(self, chat_id, layout, text):
+        """Put edited VK text into the messages of `layout`; False if it no longer splits the same way"""
+        first_limit = formatter.CAPTION_LIMIT if layout[0][0] == 'caption' else formatter.MESSAGE_LIMIT
+        chunks = formatter.split(text, first_limit)
+        if len(chunks) != len(layout):
+            return False
+        for (kind, message_id), chunk in zip(layout, chunks):
+            method, field = (self.bot.edit_message_caption, 'caption') if kind == 'caption' \
+                else (self.bot.edit_message_text, 'text')
+            # Chunks whose text did not change come back as not modified, which the dispatcher ignores
+            await self.dispatcher.send(method, chat_id, message_id=message_id, parse_mode='MarkdownV2', **{field: chunk})
+        return True
+
+    async def delete_messages(self, chat_id, message_ids):
+        for start in range(0, len(message_ids), 100):
+            await self.dispatcher.send(self.bot.delete_messages, chat_id, message_ids=message_ids[start:start + 100])
+
+    async def _send_media_group(self, caption, photos, reply_to, ctx):
+        """Send an album of any size; the MarkdownV2 caption goes on the first chunk, later chunks reply to it"""
+        first_message = None
+        for chunk in self._chunk_album(photos):
+            # InputMedia objects are built per chunk, so nothing is prepared for chunks never sent
+            chunk_caption = caption if first_message is None else None
+            chunk_reply_to = first_message.message_id if first_message else reply_to
+            messages = await ctx.step(
+                'album', partial(self._send_album_chunk, chunk, chunk_caption, chunk_reply_to, ctx)
+            )
+            if not messages and first_message is None:
+                return None
+            first_message = first_message or (messages[0] if messages else None)
+        return first_message
+
+    async def _send_album_chunk(self, chunk, caption, reply_to, ctx):
+        """Send one album chunk, uploading again if Telegram rejects a cached file_id or an oversized photo"""
+        cached = [
+            key for att in chunk
+            if self.file_ids.peek(key := media_key('photo', att['photo']))
+        ]
         try:
-            if text and len(text) <= 1024:
-                media_group[0].caption = text[:1024]
-                media_group[0].parse_mode = 'Markdown'
+            messages = await self._send_media(await self._build_media(chunk, caption, ctx), reply_to, ctx)
+        except DeliveryError as e:
+            reprocess = bool(self.images and self.images.can_process)
+            if not e.rejected or (not cached and not reprocess):
+                raise
+            logging.warning(f"Photos rejected ({e}), uploading again" + (" recompressed" if reprocess else " from VK"))
+            for key in cached:
+                self.file_ids.discard(key)
+            media = await self._build_media(chunk, caption, ctx, use_cache=False, reprocess=reprocess)
+            messages = await self._send_media(media, reply_to, ctx)
+
+        for att, message in zip(chunk, messages):
+            ctx.record(message)
+            if message.photo:
+                self.file_ids.put(media_key('photo', att['photo']), message.photo[-1].file_id)
+        return messages
+
+    async def _build_media(self, chunk, caption, ctx, use_cache=True, reprocess=False):
+        media_group = []
+        for i, att in enumerate(chunk):
+            if media := await self._process_attachment(att, ctx, caption if i == 0 else None, use_cache, reprocess):
+                media_group.append(media)
+        return media_group
 
-            messages = await self.bot.send_media_group(
-                chat_id=self.config.get('tg_channel_id'),
-                media=media_group[:10],
+    async def _send_media(self, media_group, reply_to, ctx):
+        if len(media_group) == 1:
+            media = media_group[0]
+            return [await self.dispatcher.send(
+                self.bot.send_photo,
+                ctx.chat_id,
+                photo=media.media,
+                caption=media.caption,
+                parse_mode=media.parse_mode,
                 reply_to_message_id=reply_to
-            )
-            return messages[0] if messages else None
-        except Exception as e:
-            logging.exception(f"Media group sending failed: {str(e)}")
+            )]
+        return await self.dispatcher.send(
+            self.bot.send_media_group,
+            ctx.chat_id,
+            cost=len(media_group),
+            media=media_group,
+            reply_to_message_id=reply_to
+        )
 
-    async def _send_special_attachments(self, attachments, reply_to):
+    async def _send_special_attachments(self, attachments, reply_to, ctx):
+        reply_id = reply_to.message_id if reply_to else None
         for att in attachments:
-            try:
-                att_type = att['type']
-                data = att[att_type]
-                reply_id = reply_to.message_id if reply_to else None
-
-                if att_type == 'doc':
-                    await self._handle_document(data, reply_id)
-                elif att_type == 'audio':
-                    await self._handle_audio(data, reply_id)
-                elif att_type == 'poll':
-                    await self._handle_poll(data, reply_id)
-
-            except Exception as e:
-                logging.exception(f"Attachment error ({att_type}): {str(e)}")
-
-    async def _handle_document(self, data, reply_id):
-        if not (url := data.get('url')):
-            return
+            if att['type'] in ('doc', 'audio', 'poll'):
+                await ctx.step(att['type'], partial(self._send_attachment, att, reply_id, ctx))
 
-        response = requests.get(url)
-        response.raise_for_status()
-        
+    async def _send_attachment(self, att, reply_id, ctx):
+        att_type = att['type']
+        data = att[att_type]
+        prepared = await ctx.pipeline.get(att)
+
+        if att_type == 'doc':
+            await self._handle_document(data, reply_id, ctx, prepared)
+        elif att_type == 'audio':
+            await self._handle_audio(data, reply_id, ctx, prepared)
+        elif att_type == 'poll':
+            await self._handle_poll(data, reply_id, ctx)
+
+    async def _prepare_attachment(self, att):
+        """Download an attachment ahead of its turn (used by the prefetch pipeline)"""
+        if att['type'] == 'doc':
+            return await self._prepare_document(att['doc'], prefetch=True)
+        if att['type'] == 'audio':
+            return await self._prepare_audio(att['audio'], prefetch=True)
+        if att['type'] == 'photo':
+            return await self._prepare_photo(att['photo'])
+        return None
+
+    async def _spool(self, url, file_name):
+        try:
+            session = await self.bot.session.create_session()
+            path = await spool_to_file(session, url, self.max_upload_bytes, timeout=self.download_timeout)
+        except FileTooLarge as e:
+            return PreparedFile(file_name, oversize=e.size)
+        return PreparedFile(file_name, input_file=FSInputFile(path, filename=file_name), path=path)
+
+    async def _prepare_document(self, data, prefetch=False):
         file_name = self._sanitize_filename(
             data.get('title', 'document'),
             data.get('ext', 'bin')
         )
-        
-        input_file = BufferedInputFile(
-            file=response.content,
-            filename=file_name
-        )
 
-        await self.bot.send_document(
-            chat_id=self.config.get('tg_channel_id'),
-            document=input_file,
-            reply_to_message_id=reply_id
-        )
+        size = data.get('size')
+        if size and size > self.max_upload_bytes:
+            return PreparedFile(file_name, oversize=size)
 
-    async def _handle_audio(self, data, reply_id):
-        if not (url := data.get('url')):
-            return
+        if size and not prefetch:
+            # Known size within the limit: pipe the download straight into the upload
+            return PreparedFile(
+                file_name,
+                input_file=URLInputFile(url=data['url'], filename=file_name, timeout=self.download_timeout)
+            )
+
+        # Unknown size or prefetching: spool to disk, enforcing the limit while downloading
+        return await self._spool(data['url'], file_name)
 
+    async def _prepare_audio(self, data, prefetch=False):
         file_name = self._generate_audio_name(
             data.get('artist', 'Unknown Artist'),
             data.get('title', 'Unknown Track')
         )
 
-        input_file = URLInputFile(url=url, filename=file_name)
-        
-        await self.bot.send_audio(
-            chat_id=self.config.get('tg_channel_id'),
-            audio=input_file,
+        if not prefetch:
+            return PreparedFile(
+                file_name,
+                input_file=URLInputFile(url=data['url'], filename=file_name, timeout=self.download_timeout)
+            )
+        return await self._spool(data['url'], file_name)
+
+    async def _send_cached(self, key, send, reply_id, ctx):
+        """Try sending by a cached file_id; False if there is none or Telegram rejected it"""
+        if not (file_id := self.file_ids.get(key)):
+            return False
+        try:
+            await send(file_id, reply_id, ctx)
+            return True
+        except DeliveryError as e:
+            if not e.rejected:
+                # Telegram never judged the file_id; it stays cached for the retry
+                raise
+            logging.warning(f"Cached file {key} rejected ({e}), uploading from VK again")
+            self.file_ids.discard(key)
+            return False
+
+    async def _handle_document(self, data, reply_id, ctx, prepared=None):
+        if not data.get('url'):
+            return
+
+        key = media_key('doc', data)
+        async with ctx.pipeline.lock(key):
+            if await self._send_cached(key, self._send_document, reply_id, ctx):
+                return
+
+            # Prefetched files belong to the pipeline and may still be needed by another chat
+            own_file = prepared is None
+            prepared = prepared or await self._prepare_document(data)
+            try:
+                if prepared.oversize:
+                    await self._handle_oversized_document(data, prepared.filename, prepared.oversize, reply_id, ctx)
+                    return
+                message = await self._send_document(prepared.input_file, reply_id, ctx)
+                if message and message.document:
+                    self.file_ids.put(key, message.document.file_id)
+            finally:
+                if own_file:
+                    prepared.cleanup()
+
+    async def _send_document(self, input_file, reply_id, ctx):
+        return ctx.record(await self.dispatcher.send(
+            self.bot.send_document,
+            ctx.chat_id,
+            document=input_file,
+            reply_to_message_id=reply_id
+        ))
+
+    async def _handle_oversized_document(self, data, file_name, size, reply_id, ctx):
+        size_mb = size / (1024 * 1024)
+        if self.oversize_policy == 'skip':
+            logging.warning(f"Skipping document {file_name}: {size_mb:.1f} MB is over the upload limit")
+            return
+
+        logging.info(f"Document {file_name} is {size_mb:.1f} MB, sending a link instead")
+        await self._send_text(f"📄 [{data['url']}|{file_name}] ({size_mb:.1f} MB)", reply_id, ctx)
+
+    async def _handle_audio(self, data, reply_id, ctx, prepared=None):
+        if not data.get('url'):
+            return
+
+        key = media_key('audio', data)
+        send = partial(self._send_audio, data)
+        async with ctx.pipeline.lock(key):
+            if await self._send_cached(key, send, reply_id, ctx):
+                return
+
+            own_file = prepared is None
+            prepared = prepared or await self._prepare_audio(data)
+            try:
+                if prepared.oversize:
+                    logging.warning(f"Skipping audio {prepared.filename}: over the upload limit")
+                    return
+                message = await send(prepared.input_file, reply_id, ctx)
+                if message and message.audio:
+                    self.file_ids.put(key, message.audio.file_id)
+            finally:
+                if own_file:
+                    prepared.cleanup()
+
+    async def _send_audio(self, data, audio, reply_id, ctx):
+        return ctx.record(await self.dispatcher.send(
+            self.bot.send_audio,
+            ctx.chat_id,
+            audio=audio,
             title=data.get('title', '')[:64],
             performer=data.get('artist', '')[:64],
             reply_to_message_id=reply_id
-        )
+        ))
 
-    async def _handle_poll(self, data, reply_id):
-        await self.bot.send_poll(
-            chat_id=self.config.get('tg_channel_id'),
+    async def _handle_poll(self, data, reply_id, ctx):
+        ctx.record(await self.dispatcher.send(
+            self.bot.send_poll,
+            ctx.chat_id,
             question=data['question'],
             options=[a['text'] for a in data['answers']],
             allows_multiple_answers=data.get('multiple', False),
             reply_to_message_id=reply_id
-        )
+        ))
 
     def _sanitize_filename(self, title, ext):
         clean_title = re.sub(r'[^\w\-_\. ]', '', title.strip())[:64]
@@ -215,6 +587,6 @@ class TelegramPoster:
         clean_title = re.sub(r'[^\w\-_ ]', '', title.strip())[:32]
         return f"{clean_artist} - {clean_title}.mp3"
 
-    def _log_success(self, post):
+    def _log_success(self, post, chat_id):
         log_date = datetime.fromtimestamp(post['date']).strftime('%Y-%m-%d %H:%M:%S')
-        logging.info(f"Successfully published post from {log_date}")
\ No newline at end of file
+        logging.info(f"Successfully published post from {log_date} to {chat_id}")
\ No newline at end of file
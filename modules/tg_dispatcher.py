@@ -0,0 +1,170 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from aiogram.exceptions import TelegramBadRequest, TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+from aiogram.types import InputFile, InputMedia, InputMediaAudio, InputMediaDocument, InputMediaPhoto, URLInputFile
+from modules import metrics
+
+TG_REQUEST_SECONDS = metrics.histogram('vk2tg_tg_request_seconds', "Bot API call latency", ['method'])
+TG_RETRIES = metrics.counter('vk2tg_tg_retries_total', "Retried Bot API calls", ['method', 'reason'])
+TG_DEAD_LETTERS = metrics.counter('vk2tg_tg_dead_letters_total', "Bot API calls given up on", ['method'])
+
+INPUT_MEDIA = {'photo': InputMediaPhoto, 'document': InputMediaDocument, 'audio': InputMediaAudio}
+
+class DeliveryError(Exception):
+    @property
+    def rejected(self):
+        """True if Telegram refused the request itself, e.g. a stale file_id, rather than failing to deliver it"""
+        return isinstance(self.__cause__, TelegramBadRequest)
+
+def _plain(value, local_files):
+    """JSON-ready copy of a send argument: files become their URL or file_id; local files, which
+    will be gone by the time of a replay, are dropped and listed in `local_files`"""
+    if isinstance(value, URLInputFile):
+        return value.url
+    if isinstance(value, InputFile):
+        local_files.append(value.filename)
+        return None
+    if isinstance(value, InputMedia):
+        return {
+            **value.model_dump(exclude_none=True, exclude_defaults=True),
+            'type': value.type, 'media': _plain(value.media, local_files)
+        }
+    if isinstance(value, dict):
+        return {key: _plain(item, local_files) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(item, local_files) for item in value]
+    return value
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, tokens=1):
+        tokens = min(tokens, self.capacity)
+        while True:
+            self._refill()
+            wait = self.blocked_until - time.monotonic()
+            if wait <= 0 and self.tokens >= tokens:
+                self.tokens -= tokens
+                return
+            await asyncio.sleep(max(wait, (tokens - self.tokens) / self.rate))
+
+    def pause(self, seconds):
+        """Block the bucket entirely, e.g. for a flood-wait"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+class TelegramDispatcher:
+    """Single exit for Bot API sends: global and per-chat rate limits, RetryAfter, retries, dead letters"""
+
+    def __init__(self, store=None, global_rate=30, chat_rate=20 / 60, chat_burst=20, max_retries=5,
+                 retention_days=30):
+        self.store = store
+        if store is not None:
+            store.execute('DELETE FROM dead_letters WHERE failed_at < ?', (time.time() - retention_days * 86400,))
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chat_buckets = {}
+        self.max_retries = max_retries
+        self.retries = 0
+        self.dead_letters = 0
+
+    def _chat_bucket(self, chat_id):
+        if chat_id not in self.chat_buckets:
+            self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return self.chat_buckets[chat_id]
+
+    async def send(self, method, chat_id, cost=1, **kwargs):
+        """Call a bound `bot.send_*` method for a chat; `cost` is the number of messages it produces"""
+        chat_bucket = self._chat_bucket(chat_id)
+        error = None
+        for attempt in range(1, self.max_retries + 1):
+            await chat_bucket.acquire(cost)
+            await self.global_bucket.acquire(cost)
+            try:
+                with TG_REQUEST_SECONDS.time(method=method.__name__):
+                    return await method(chat_id=chat_id, **kwargs)
+            except TelegramRetryAfter as e:
+                error = e
+                chat_bucket.pause(e.retry_after)
+                TG_RETRIES.inc(method=method.__name__, reason='flood')
+                logging.warning(f"Flood control in chat {chat_id}: retrying {method.__name__} in {e.retry_after}s")
+            except TelegramBadRequest as e:
+                if 'message is not modified' not in str(e):
+                    error = e
+                    break
+                # Editing a message to the text it already has changes nothing; not a failure
+                logging.debug(f"{method.__name__} in chat {chat_id}: message not modified")
+                return None
+            except (TelegramNetworkError, TelegramServerError) as e:
+                error = e
+                TG_RETRIES.inc(method=method.__name__, reason='network' if isinstance(e, TelegramNetworkError) else 'server')
+                delay = random.uniform(0, min(60, 2 ** attempt))
+                logging.warning(f"{method.__name__} failed ({e}), retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+            except Exception as e:
+                # Bad requests and permission errors will not get better by retrying
+                error = e
+                break
+            self.retries += 1
+
+        self._dead_letter(method.__name__, chat_id, kwargs, error)
+        raise DeliveryError(f"{method.__name__} to {chat_id} failed: {error}") from error
+
+    def _dead_letter(self, method_name, chat_id, kwargs, error):
+        self.dead_letters += 1
+        TG_DEAD_LETTERS.inc(method=method_name)
+        logging.error(f"Dead letter: {method_name} to {chat_id}: {error}")
+        if self.store is None:
+            return
+        local_files = []
+        payload = _plain(kwargs, local_files)
+        self.store.execute(
+            'INSERT INTO dead_letters (chat_id, method, payload, error, failed_at, replayable) VALUES (?, ?, ?, ?, ?, ?)',
+            (chat_id, method_name, json.dumps(payload, ensure_ascii=False, default=str),
+             str(error) + (f" (local files: {', '.join(local_files)})" if local_files else ''),
+             time.time(), not local_files)
+        )
+
+    def list_dead_letters(self, limit=100):
+        """Newest dead letters as (id, chat_id, method, error, failed_at, replayable)"""
+        return self.store.query(
+            'SELECT id, chat_id, method, error, failed_at, replayable FROM dead_letters ORDER BY id DESC LIMIT ?',
+            (limit,)
+        )
+
+    async def replay(self, bot, ids=None):
+        """Send dead letters again, oldest first, all or those in `ids`; returns (sent, failed).
+
+        A replayed send is not linked to its post: edit sync will not follow it. Letters with
+        local files cannot be replayed and are left in place; one failing again is dead-lettered anew.
+        """
+        rows = self.store.query('SELECT id, chat_id, method, payload FROM dead_letters WHERE replayable = 1 ORDER BY id')
+        sent = failed = 0
+        for letter_id, chat_id, method_name, payload in rows:
+            if ids and letter_id not in ids:
+                continue
+            kwargs = json.loads(payload)
+            if 'media' in kwargs and isinstance(kwargs['media'], list):
+                kwargs['media'] = [INPUT_MEDIA[item.pop('type')](**item) for item in kwargs['media']]
+            cost = len(kwargs['media']) if isinstance(kwargs.get('media'), list) else 1
+            try:
+                await self.send(getattr(bot, method_name), chat_id, cost=cost, **kwargs)
+                logging.info(f"Dead letter {letter_id} ({method_name} to {chat_id}) replayed")
+                sent += 1
+            except DeliveryError:
+                failed += 1
+            self.store.execute('DELETE FROM dead_letters WHERE id = ?', (letter_id,))
+        return sent, failed
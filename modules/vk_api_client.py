@@ -1,69 +1,324 @@
-import vk_api
+import aiohttp
+import json
 import logging
+from modules import metrics
+from modules.author_cache import AuthorCache
+from modules.http import HttpPool
+from modules.models import slim_post
+
+VK_API_URL = 'https://api.vk.com/method'
+VK_API_VERSION = '5.131'
+EXECUTE_BATCH_SIZE = 25
+CATCHUP_PAGE_SIZE = 100
+GET_BY_ID_BATCH_SIZE = 100
+HISTORY_PAGES_PER_CALL = 10
+
+VK_REQUEST_SECONDS = metrics.histogram('vk2tg_vk_request_seconds', "VK API call latency", ['method'])
+VK_ERRORS = metrics.counter('vk2tg_vk_errors_total', "Failed VK API calls", ['method'])
+VK_POLL_SECONDS = metrics.histogram('vk2tg_vk_poll_seconds', "Duration of fetching new posts of all due walls")
+AUTHOR_RESOLVE_SECONDS = metrics.histogram('vk2tg_author_resolve_seconds', "Duration of resolving author names")
+
+class VKAPIError(Exception):
+    def __init__(self, code, message):
+        super().__init__(f"VK API error {code}: {message}")
+        self.code = code
+        self.message = message
 
 class VKClient:
-    def __init__(self, config_handler):
+    def __init__(self, config_handler, http=None):
         self.config = config_handler
         self._validate_config()
         self._init_session()
+        # Without a shared pool the client keeps one of its own and closes it
+        self.owns_http = http is None
+        self.http = http or HttpPool(limit=self.config.get('vk_pool_size', 10))
 
     def _validate_config(self):
         if not self.config.get('vk_access_token'):
             raise ValueError("Missing VK access token!")
-        if not self.config.get('vk_user_id'):
+        if not self.config.get('vk_user_id') and not self.config.get('vk_sources'):
             raise ValueError("Missing VK user ID!")
 
     def _init_session(self):
-        try:
-            vk_session = vk_api.VkApi(
-                token=self.config.get('vk_access_token'),
-                api_version="5.131"
-            )
-            self.vk = vk_session.get_api()
-            logging.info('VK API initialized')
-        except Exception as e:
-            logging.exception(f"VK init error: {e}")
-            raise
-
-    def get_new_posts(self):
-        try:
-            response = self.vk.wall.get(
-                owner_id=self.config.get('vk_user_id'),
-                count=10,
-                filter='owner',
-                extended=1
-            )
-            return self._process_posts(response['items'])
-        except Exception as e:
-            logging.exception(f"Posts fetch error: {e}")
-            return []
+        """Prepare transport settings; the pooled session is opened lazily inside the event loop"""
+        self.api_url = (self.config.get('vk_api_url') or VK_API_URL).rstrip('/')
+        self.timeout = aiohttp.ClientTimeout(total=self.config.get('vk_request_timeout', 15))
+        self.poll_window = self.config.get('poll_window', 10)
+        self.catchup_max_pages = self.config.get('catchup_max_pages', 20)
+        self.execute_errors = []
+        self.authors = AuthorCache(
+            self.config.get('author_cache_path') or self.config.data_path('author_cache.json'),
+            max_size=self.config.get('author_cache_size', 5000),
+            ttl=self.config.get('author_cache_ttl', 86400)
+        )
+        logging.info('VK API initialized')
+
+    def _get_session(self):
+        return self.http.session()
+
+    async def close(self):
+        if self.owns_http:
+            await self.http.close()
+
+    async def _call(self, method, usage=None, **params):
+        """Call an API method; `usage`, if given, counts the request and its response bytes"""
+        with VK_REQUEST_SECONDS.time(method=method):
+            try:
+                return await self._request(method, params, usage)
+            except Exception:
+                VK_ERRORS.inc(method=method)
+                raise
+
+    async def _request(self, method, params, usage=None):
+        payload = {
+            'access_token': self.config.get('vk_access_token'),
+            'v': VK_API_VERSION,
+            **{k: v for k, v in params.items() if v is not None}
+        }
+        async with self._get_session().post(f"{self.api_url}/{method}", data=payload, timeout=self.timeout) as response:
+            response.raise_for_status()
+            body = await response.read()
+
+        if usage is not None:
+            usage['requests'] += 1
+            usage['bytes'] += len(body)
+        data = json.loads(body)
+
+        if 'error' in data:
+            error = data['error']
+            raise VKAPIError(error.get('error_code'), error.get('error_msg', 'Unknown error'))
+        self.execute_errors = data.get('execute_errors', [])
+        return data['response']
+
+    def get_sources(self):
+        """Walls to mirror: `vk_sources` list or the single `vk_user_id`"""
+        sources = self.config.get('vk_sources') or [self.config.get('vk_user_id')]
+        return [int(source) for source in sources]
+
+    async def get_new_posts(self, owner_id=None, is_seen=None):
+        owner_id = owner_id or self.config.get('vk_user_id')
+        walls, _ = await self.get_new_posts_multi([owner_id], is_seen)
+        return walls[owner_id]
+
+    async def get_new_posts_multi(self, sources=None, is_seen=None):
+        """Fetch unseen posts of several walls: ({owner_id: posts}, {owner_id: error}).
+
+        Steady state costs one `execute` per 25 walls for a small window that is cut at the
+        first already seen post. Walls whose whole window is unseen (e.g. after downtime) are
+        paged back with `offset` until a seen post is reached. Walls that failed have no posts
+        and are listed with their error; concurrent polls each get their own.
+        """
+        with VK_POLL_SECONDS.time():
+            return await self._get_new_posts_multi(sources or self.get_sources(), is_seen or (lambda post: False))
+
+    async def _get_new_posts_multi(self, sources, is_seen):
+        # Counted per poll: polls of other walls run concurrently on the same client
+        usage = {'requests': 0, 'bytes': 0}
+        errors = {}
+
+        results = {}
+        windows = await self._fetch_windows(sources, errors, usage)
+        for owner_id in list(windows):
+            # Pop each raw window so it can be freed as soon as its wall is handled
+            items = windows.pop(owner_id)
+            if items is None:
+                results[owner_id] = []
+                continue
+            fresh, caught_up = self._take_unseen(items, is_seen)
+            if not caught_up and len(items) >= self.poll_window:
+                try:
+                    fresh += await self._catch_up(owner_id, len(items), is_seen, usage)
+                except Exception as e:
+                    # Publishing only the newest posts would move the cursor past the gap
+                    logging.exception(f"Catch-up fetch error for wall {owner_id}: {e}")
+                    errors[owner_id] = e
+                    results[owner_id] = []
+                    continue
+            unique = {post['id']: post for post in fresh}
+            results[owner_id] = self.normalize_posts(unique.values())
+
+        self.authors.save()
+        logging.info(
+            f"VK poll of {len(sources)} walls: {usage['requests']} requests, {usage['bytes'] / 1024:.1f} KB"
+        )
+        return results, errors
 
-    def _process_posts(self, items):
-        processed = []
+    async def _fetch_windows(self, sources, errors, usage=None):
+        """Newest `poll_window` posts of each wall, or None where the fetch failed and its error went into `errors`"""
+        if len(sources) == 1:
+            try:
+                response = await self.get_wall(sources[0], self.poll_window, usage=usage)
+                return {sources[0]: response['items']}
+            except Exception as e:
+                logging.exception(f"Posts fetch error: {e}")
+                errors[sources[0]] = e
+                return {sources[0]: None}
+
+        windows = {}
+        for start in range(0, len(sources), EXECUTE_BATCH_SIZE):
+            batch = sources[start:start + EXECUTE_BATCH_SIZE]
+            try:
+                responses = await self._call('execute', usage=usage, code=self._build_wall_script(batch))
+                execute_errors = iter(self.execute_errors)
+            except Exception as e:
+                logging.exception(f"Batched posts fetch error: {e}")
+                responses = [False] * len(batch)
+                execute_errors = iter([e] * len(batch))
+
+            for owner_id, response in zip(batch, responses):
+                if not response:
+                    error = next(execute_errors, None)
+                    if isinstance(error, dict):
+                        error = VKAPIError(error.get('error_code'), error.get('error_msg', 'Unknown error'))
+                    logging.warning(f"Posts fetch failed for wall {owner_id}: {error}")
+                    errors[owner_id] = error
+                    windows[owner_id] = None
+                else:
+                    self._seed_authors(response)
+                    windows[owner_id] = response['items']
+        return windows
+
+    def _take_unseen(self, items, is_seen):
+        """Leading unseen posts and whether a seen one was reached; pinned posts never stop the scan"""
+        fresh = []
         for item in items:
-            post = item.copy()
-            if 'attachments' in post:
-                for att in post['attachments']:
-                    if att['type'] == 'audio':
-                        att['audio'] = self._get_audio_info(att['audio'])
-            processed.append(post)
-        return processed
-
-    def _get_audio_info(self, audio_data):
+            if is_seen(item):
+                if item.get('is_pinned'):
+                    continue
+                return fresh, True
+            fresh.append(item)
+        return fresh, False
+
+    async def _catch_up(self, owner_id, offset, is_seen, usage=None):
+        """Page back through a wall after downtime until reaching an already seen post"""
+        posts = []
+        for page in range(1, self.catchup_max_pages + 1):
+            response = await self.get_wall(owner_id, CATCHUP_PAGE_SIZE, offset, usage=usage)
+            fresh, caught_up = self._take_unseen(response['items'], is_seen)
+            posts += fresh
+            offset += len(response['items'])
+            if caught_up or len(response['items']) < CATCHUP_PAGE_SIZE:
+                break
+        else:
+            logging.warning(f"Catch-up for wall {owner_id} stopped after {self.catchup_max_pages} pages")
+        logging.info(f"Catch-up for wall {owner_id}: {len(posts)} older posts in {page} pages")
+        return posts
+
+    def _wall_params(self, owner_id, count=None, offset=0):
         return {
-            'artist': audio_data.get('artist', 'Unknown Artist'),
-            'title': audio_data.get('title', 'Unknown Track'),
-            'url': audio_data.get('url')
+            'owner_id': owner_id,
+            'count': count or self.poll_window,
+            'offset': offset or None,
+            'filter': 'owner',
+            'extended': 1
         }
 
-    def get_author_name(self, owner_id):
-        try:
-            if owner_id > 0:
-                user = self.vk.users.get(user_ids=owner_id, fields='first_name,last_name')[0]
-                return f"{user['first_name']} {user['last_name']}"
+    def _build_wall_script(self, sources):
+        calls = [
+            'API.wall.get(' + json.dumps({k: v for k, v in self._wall_params(owner_id).items() if v is not None}) + ')'
+            for owner_id in sources
+        ]
+        return f"return [{','.join(calls)}];"
+
+    async def get_wall(self, owner_id, count=CATCHUP_PAGE_SIZE, offset=0, usage=None):
+        """One raw `wall.get` page with the profiles and groups VK sends along; their names go to the author cache"""
+        response = await self._call('wall.get', usage=usage, **self._wall_params(owner_id, count, offset))
+        self._seed_authors(response)
+        return response
+
+    async def get_long_poll_server(self, group_id, token):
+        """Bots Long Poll server, key and ts of a community, requested with its community token"""
+        return await self._call('groups.getLongPollServer', group_id=group_id, access_token=token)
+
+    async def check_long_poll(self, server, ts, wait=25):
+        """Wait up to `wait` seconds for Long Poll events after `ts`; returns the raw response"""
+        params = {'act': 'a_check', 'key': server['key'], 'ts': ts, 'wait': wait}
+        timeout = aiohttp.ClientTimeout(total=wait + 10)
+        async with self._get_session().get(server['server'], params=params, timeout=timeout) as response:
+            response.raise_for_status()
+            return json.loads(await response.read())
+
+    async def get_wall_history(self, owner_id, offset=0, pages=HISTORY_PAGES_PER_CALL):
+        """Up to `pages` full pages of a wall from `offset` back in time, fetched in one `execute`"""
+        pages = max(1, min(pages, EXECUTE_BATCH_SIZE))
+        calls = [
+            'API.wall.get(' + json.dumps({
+                k: v for k, v in self._wall_params(owner_id, CATCHUP_PAGE_SIZE, offset + page * CATCHUP_PAGE_SIZE).items()
+                if v is not None
+            }) + ')'
+            for page in range(pages)
+        ]
+        responses = await self._call('execute', code=f"return [{','.join(calls)}];")
+        errors = iter(self.execute_errors)
+        items = []
+        for response in responses:
+            if not response:
+                error = next(errors, None) or {}
+                raise VKAPIError(error.get('error_code'), error.get('error_msg', 'Unknown error'))
+            self._seed_authors(response)
+            items += response['items']
+            if len(response['items']) < CATCHUP_PAGE_SIZE:
+                break
+        self.authors.save()
+        return self.normalize_posts(items)
+
+    async def get_posts_by_id(self, keys):
+        """Current versions of posts by (owner_id, post_id), 100 per `wall.getById`; deleted posts are missing"""
+        posts = {}
+        for start in range(0, len(keys), GET_BY_ID_BATCH_SIZE):
+            batch = keys[start:start + GET_BY_ID_BATCH_SIZE]
+            response = await self._call(
+                'wall.getById', posts=','.join(f"{owner_id}_{post_id}" for owner_id, post_id in batch), extended=1
+            )
+            self._seed_authors(response)
+            for post in self.normalize_posts(response['items']):
+                posts[(post['owner_id'], post['id'])] = post
+        return posts
+
+    def _seed_authors(self, response):
+        self.authors.seed(response.get('profiles', []), response.get('groups', []))
+
+    def normalize_posts(self, items):
+        """Compact posts for the pipeline; callers drop already seen items before this"""
+        return [slim_post(item) for item in items]
+
+    async def resolve_authors(self, owner_ids):
+        """Map owner_ids to names: cache first, then one users.get and one groups.getById"""
+        with AUTHOR_RESOLVE_SECONDS.time():
+            return await self._resolve_authors(owner_ids)
+
+    async def _resolve_authors(self, owner_ids):
+        names = {}
+        user_ids, group_ids = [], []
+        for owner_id in set(owner_ids):
+            name = self.authors.get(owner_id)
+            if name is not None:
+                names[owner_id] = name
+            elif owner_id > 0:
+                user_ids.append(owner_id)
             else:
-                group = self.vk.groups.getById(group_ids=str(abs(owner_id)))[0]
-                return group['name']
-        except Exception as e:
-            logging.exception(f"Author info error: {e}")
-            return "Unknown Author"
\ No newline at end of file
+                group_ids.append(-owner_id)
+
+        if user_ids:
+            try:
+                users = await self._call('users.get', user_ids=','.join(map(str, user_ids)))
+                self.authors.seed(profiles=users)
+            except Exception as e:
+                logging.exception(f"Author info error: {e}")
+        if group_ids:
+            try:
+                groups = await self._call('groups.getById', group_ids=','.join(map(str, group_ids)))
+                self.authors.seed(groups=groups)
+            except Exception as e:
+                logging.exception(f"Author info error: {e}")
+
+        for owner_id in [*user_ids, *(-group_id for group_id in group_ids)]:
+            entry = self.authors.entries.get(owner_id)
+            names[owner_id] = entry[0] if entry else "Unknown Author"
+
+        self.authors.save()
+        logging.debug(f"Author cache stats: {self.authors.stats()}")
+        return names
+
+    async def get_author_name(self, owner_id):
+        return (await self.resolve_authors([owner_id]))[owner_id]
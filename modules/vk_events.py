@@ -0,0 +1,186 @@
+import asyncio
+import logging
+from aiohttp import web
+
+LONGPOLL_WAIT = 25
+
+class LongPollListener:
+    """Bots Long Poll of one community, turning `wall_post_new` events into posts.
+
+    Needs a community token with Long Poll enabled in the community settings. Reports the
+    stream going live or down through `on_state`, so polling can stand in while it is down.
+    """
+
+    def __init__(self, vk, group_id, token, on_post, on_state, wait=LONGPOLL_WAIT):
+        self.vk = vk
+        self.group_id = group_id
+        self.token = token
+        self.on_post = on_post
+        self.on_state = on_state
+        self.wait = wait
+        self.live = False
+
+    async def run(self):
+        errors = 0
+        while True:
+            try:
+                server = await self.vk.get_long_poll_server(self.group_id, self.token)
+                await self._set_live(True)
+                errors = 0
+                await self._listen(server)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                errors += 1
+                delay = min(300, 2 ** errors)
+                logging.warning(f"Long poll of community {self.group_id} failed ({e}), polling the wall; retry in {delay}s")
+                await self._set_live(False)
+                await asyncio.sleep(delay)
+
+    async def _set_live(self, live):
+        if live != self.live:
+            self.live = live
+            await self.on_state(-self.group_id, live)
+
+    async def _listen(self, server):
+        """Consume events until VK asks for a new key"""
+        ts = server['ts']
+        while True:
+            data = await self.vk.check_long_poll(server, ts, self.wait)
+
+            if 'failed' in data:
+                if data['failed'] == 1:
+                    # Events were lost: keep listening, but let polling pick up the gap
+                    ts = data['ts']
+                    await self._set_live(False)
+                    await self._set_live(True)
+                    continue
+                logging.info(f"Long poll key of community {self.group_id} expired, reconnecting")
+                return
+
+            ts = data['ts']
+            for update in data.get('updates', []):
+                await dispatch(update, self.on_post)
+
+class CallbackReceiver:
+    """Local HTTP endpoint for the VK Callback API.
+
+    Answers confirmation requests with the code configured per community, checks the secret key
+    and queues `wall_post_new` events; VK retries anything not answered with `ok`. Events are
+    published as they come, so the secret key is mandatory.
+    """
+
+    def __init__(self, on_post, confirmations, secret, host='127.0.0.1', port=8080, path='/vk-callback'):
+        if not secret:
+            raise ValueError("VK Callback API receiver needs a secret key")
+        self.on_post = on_post
+        self.confirmations = {abs(int(group_id)): code for group_id, code in confirmations.items()}
+        self.secret = secret
+        self.host = host
+        self.port = port
+        self.path = path
+        self.runner = None
+        self.tasks = set()
+
+    def groups(self):
+        return list(self.confirmations)
+
+    async def handle(self, request):
+        try:
+            event = await request.json()
+        except ValueError:
+            return web.Response(status=400, text='bad request')
+
+        group_id = event.get('group_id')
+        if group_id not in self.confirmations:
+            return web.Response(status=404, text='unknown community')
+        if event.get('type') == 'confirmation':
+            return web.Response(text=self.confirmations[group_id])
+        if event.get('secret') != self.secret:
+            logging.warning(f"Callback event for community {group_id} with a wrong secret")
+            return web.Response(status=403, text='forbidden')
+
+        # Answer right away; VK resends events that take too long to acknowledge
+        task = asyncio.create_task(dispatch(event, self.on_post))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return web.Response(text='ok')
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        logging.info(f"VK Callback API receiver listening on {self.host}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+        for task in self.tasks:
+            task.cancel()
+
+async def dispatch(event, on_post):
+    """Hand published wall posts of an event to `on_post(owner_id, post)`"""
+    if event.get('type') != 'wall_post_new':
+        return
+    post = event.get('object') or {}
+    if post.get('post_type', 'post') != 'post':
+        # Suggested and postponed posts are not on the wall yet
+        return
+    try:
+        await on_post(-abs(int(event['group_id'])), post)
+    except Exception as e:
+        logging.exception(f"Error handling VK event: {str(e)}")
+
+class VKEvents:
+    """Event-driven ingestion for community walls: Bots Long Poll and/or a Callback API receiver"""
+
+    def __init__(self, config, vk, on_post, on_state):
+        self.vk = vk
+        self.on_post = on_post
+        self.on_state = on_state
+        sources = set(vk.get_sources())
+        self.listeners = [
+            LongPollListener(vk, abs(int(group_id)), token, self._on_post, on_state)
+            for group_id, token in (config.get('vk_group_tokens') or {}).items()
+            if -abs(int(group_id)) in sources
+        ]
+        self.receiver = None
+        if (callback := config.get('vk_callback')) and not callback.get('secret'):
+            logging.error("vk_callback has no secret key, not starting the VK Callback API receiver")
+        elif callback:
+            self.receiver = CallbackReceiver(
+                self._on_post,
+                callback.get('confirmations') or {},
+                secret=callback['secret'],
+                host=callback.get('host', '127.0.0.1'),
+                port=callback.get('port', 8080),
+                path=callback.get('path', '/vk-callback')
+            )
+        self.sources = sources
+        self.tasks = []
+
+    async def _on_post(self, owner_id, post):
+        if owner_id in self.sources:
+            await self.on_post(owner_id, post)
+
+    async def start(self):
+        self.tasks = [asyncio.create_task(listener.run()) for listener in self.listeners]
+        if self.receiver:
+            try:
+                await self.receiver.start()
+            except OSError as e:
+                logging.error(f"Cannot start the VK Callback API receiver, polling instead: {e}")
+                self.receiver = None
+                return
+            for group_id in self.receiver.groups():
+                if -group_id in self.sources:
+                    await self.on_state(-group_id, True)
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        if self.receiver:
+            await self.receiver.stop()